@@ -0,0 +1,36 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+from benchmarks.conftest import BENCH_ROUNDS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['pandas', 'plotly', 'sklearn', 'pycountry', 'pycountry_convert', 'duckdb']
+
+# (statement run in a fresh interpreter, heavy modules it must not load)
+USE_CASES = {
+    'cli_help': ("import sys, main; sys.argv = ['main.py', '--help']\ntry: main.main()\nexcept SystemExit: pass",
+                 HEAVY_MODULES),
+    'reader_only': ("from pipeline.reader.reader import read_csv_file", ['plotly', 'sklearn', 'pycountry', 'duckdb']),
+    'report_only': ("from pipeline.writer.writer import Report, AggregationCache", ['sklearn', 'pycountry', 'duckdb']),
+    'full_pipeline': ("import main; main.build_pipeline(['analyst'])", ['plotly', 'sklearn', 'pycountry', 'duckdb']),
+}
+
+
+def cold_start(statement):
+    """
+    Run the statement in a new interpreter and return the heavy modules it loaded.
+    """
+    script = statement + "\nimport json, sys\nprint(json.dumps(sorted(set(m.split('.')[0] for m in sys.modules))))"
+    result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, capture_output=True, text=True, check=True)
+    loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    return [module for module in HEAVY_MODULES if module in loaded]
+
+
+@pytest.mark.parametrize('use_case', list(USE_CASES))
+def test_cold_start(benchmark, use_case):
+    statement, deferred = USE_CASES[use_case]
+    loaded = benchmark.pedantic(cold_start, args=(statement,), rounds=BENCH_ROUNDS, iterations=1)
+    benchmark.extra_info['loaded'] = loaded
+    assert not set(loaded) & set(deferred)
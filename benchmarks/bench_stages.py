@@ -0,0 +1,89 @@
+import pytest
+from pipeline.utils.constants import *
+from pipeline.processors.processor import *
+from pipeline.reader.reader import *
+from pipeline.writer.writer import *
+
+FEATURES = ["avg_temp (°C)", "average_rain_fall (mm/year)", "pest_value (tonnes)"]
+TARGET = "yield_value (hg/ha)"
+COLUMNS = {
+    'pesticide': {'Value': 'pest_value (tonnes)'},
+    'rain': {'average_rain_fall_mm_per_year': 'average_rain_fall (mm/year)'},
+    'temperature': {'avg_temp (°C)': 'avg_temp (°C)'},
+    'yield': {'Item': 'crop_types', 'Value': 'yield_value (hg/ha)'},
+}
+
+
+def test_read_rain_data(run_stage, paths):
+    df = run_stage(read_rain_data, paths['rain'], schema=RAIN_SCHEMA, na_values=NA_VALUES)
+    assert set(df.columns) == set(RAIN_SCHEMA)
+
+
+def test_read_yield_file(run_stage, paths):
+    df = run_stage(read_csv_file, paths['yield'], ';', schema=YIELD_SCHEMA)
+    assert set(df.columns) == set(YIELD_SCHEMA)
+
+
+def test_read_temp_file(run_stage, paths):
+    df = run_stage(read_temp_file, paths['temperature'], 'ISO-8859-1', schema=TEMPERATURE_SCHEMA)
+    assert set(df.columns) == set(TEMPERATURE_SCHEMA)
+
+
+def test_merge_data(run_stage, sources):
+    def chained_merge():
+        df = merge_data(sources['pesticide'], sources['rain'], ['Country', 'Year'])
+        df = merge_data(df, sources['temperature'], ['Country', 'Year'])
+        return merge_data(df, sources['yield'], ['Country', 'Year'])
+
+    df = run_stage(chained_merge)
+    assert len(df) > 0
+
+
+def test_combine_sources(run_stage, sources):
+    df = run_stage(lambda: CombineSources(sources, COLUMNS, ['Country', 'Year']).merge())
+    assert len(df) > 0
+
+
+def test_cleaning_rules(run_stage, merged):
+    rules = CleaningRules.from_file(CLEANING_RULES_FILE)
+    run_stage(rules.apply, merged, rows=len(merged))
+
+
+def test_map_continent(run_stage, merged, paths):
+    df = run_stage(lambda: TranformRawData(merged, 'average_rain_fall (mm/year)', paths['continents']).map_continent(),
+                   rows=len(merged))
+    assert 'Continent' in df.columns
+
+
+def test_train_and_evaluate(run_stage, merged):
+    rf_model = RfPredictionModel(merged, FEATURES, TARGET)
+    run_stage(rf_model.train_and_evaluate, rows=len(merged))
+    assert rf_model.mse is not None
+
+
+def test_report_aggregations(run_stage, merged):
+    def aggregate():
+        aggregates = AggregationCache(merged, REPORT_AGGREGATIONS)
+        return [aggregates.compute(keys) for keys in aggregates.plan]
+
+    run_stage(aggregate, rows=len(merged))
+
+
+def test_partition_statistics(run_stage, merged):
+    statistics = PartitionStatistics()
+    run_stage(statistics.compute, merged, rows=len(merged))
+    assert set(statistics.describe().columns) == set(merged.describe().columns)
+
+
+def test_partition_statistics_update(run_stage, merged):
+    # a new last year only computes its own partitions and merges their digests
+    statistics = PartitionStatistics()
+    statistics.compute(merged[merged['Year'] < merged['Year'].max()])
+    added = merged[merged['Year'] == merged['Year'].max()]
+    run_stage(statistics.update, merged, added, added.iloc[:0], rows=len(added))
+
+
+def test_save_figure(run_stage, merged, tmp_path):
+    pytest.importorskip('kaleido')
+    fig = GenerateReport(merged, renderer=FigureRenderer(1), figure_path=str(tmp_path) + '/').generate_yield_trend_plot()
+    run_stage(save_figure, fig, str(tmp_path / 'yield_trend_plot.png'))
@@ -0,0 +1,63 @@
+import os
+import pandas as pd
+import pytest
+from benchmarks.synthetic import generate_datasets
+from pipeline.utils.constants import *
+from pipeline.utils.memory import measure_memory
+from pipeline.processors.processor import *
+from pipeline.reader.reader import *
+
+# comma separated dataset sizes in yield rows, e.g. BENCH_ROWS=10000,100000,1000000,10000000
+BENCH_ROWS = [int(rows) for rows in os.environ.get('BENCH_ROWS', '10000').split(',')]
+BENCH_ROUNDS = int(os.environ.get('BENCH_ROUNDS', '3'))
+
+
+@pytest.fixture(scope='session', autouse=True)
+def copy_on_write():
+    """
+    Run the stages in copy-on-write mode, as the pipeline does.
+    """
+    with pd.option_context('mode.copy_on_write', True):
+        yield
+
+
+@pytest.fixture(scope='session', params=BENCH_ROWS, ids=lambda rows: f"{rows}rows")
+def paths(request, tmp_path_factory):
+    data_dir = str(tmp_path_factory.mktemp(f"agri{request.param}"))
+    generate_datasets(data_dir, request.param)
+    return get_data_paths(data_dir)
+
+
+@pytest.fixture(scope='session')
+def sources(paths):
+    rules = CleaningRules.from_file(CLEANING_RULES_FILE)
+    df_rain = read_rain_data(paths['rain'], schema=RAIN_SCHEMA, na_values=NA_VALUES)
+    sources = {
+        'pesticide': read_csv_file(paths['pesticide'], ';', schema=PESTICIDE_SCHEMA),
+        'rain': df_rain.rename(columns={'country': 'Country', 'year': 'Year'}),
+        'temperature': read_temp_file(paths['temperature'], 'ISO-8859-1', schema=TEMPERATURE_SCHEMA),
+        'yield': read_csv_file(paths['yield'], ';', schema=YIELD_SCHEMA),
+    }
+    return {name: rules.apply(df) for name, df in sources.items()}
+
+
+@pytest.fixture(scope='session')
+def merged(sources, paths):
+    from main import combine_and_transform
+    return combine_and_transform(sources, paths['continents'])
+
+
+@pytest.fixture
+def run_stage(benchmark):
+    """
+    Time a stage over BENCH_ROUNDS rounds and record its rss usage in the benchmark extra info.
+    """
+    def run(func, *args, rows=None, **kwargs):
+        usage = {}
+        with measure_memory('stage', usage):
+            result = benchmark.pedantic(func, args=args, kwargs=kwargs, rounds=BENCH_ROUNDS, iterations=1)
+        benchmark.extra_info.update(usage['stage'])
+        if rows is not None:
+            benchmark.extra_info['rows'] = rows
+        return result
+    return run
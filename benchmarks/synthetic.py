@@ -0,0 +1,99 @@
+import argparse
+import math
+import os
+import numpy as np
+import pandas as pd
+
+# names with the quirks of the real feeds: commas that make the rain rows ragged
+# and accents that end up as mojibake in the ISO-8859-1 temperature file
+COUNTRIES = [
+    'Albania', 'Algeria', 'Angola', 'Argentina', 'Armenia', 'Australia', 'Austria', 'Bahamas, The',
+    'Bangladesh', 'Belgium', 'Bolivia (Plurinational State of)', 'Botswana', 'Brazil', 'Cameroon',
+    'Canada', 'Chile', 'Colombia', "Côte d'Ivoire", 'Denmark', 'Ecuador', 'Egypt', 'France', 'Germany',
+    'Ghana', 'Greece', 'Guatemala', 'India', 'Indonesia', 'Iran (Islamic Republic of)', 'Italy', 'Japan',
+    'Kenya', 'Korea, Republic of', 'Madagascar', 'Mexico', 'Morocco', 'Nigeria', 'Peru', 'Poland',
+    'Portugal', 'Réunion', 'Senegal', 'South Africa', 'Spain', 'Sweden', 'Thailand', 'Turkey', 'Uganda',
+    'United Kingdom', 'Zimbabwe',
+]
+CROPS = ['Cassava', 'Maize', 'Plantains and others', 'Potatoes', 'Rice, paddy', 'Sorghum', 'Soybeans',
+         'Sweet potatoes', 'Wheat', 'Yams']
+FIRST_YEAR = 1961
+SENTINEL_SHARE = 0.03                 # share of rain rows carrying the '..' sentinel
+STATIONS = 2                          # temperature rows per country and year
+FAO_HEADER = ['Domain Code', 'Domain', 'Area Code', 'Country', 'Element Code', 'Element', 'Item Code', 'Item',
+              'Year Code', 'Year', 'Unit', 'Value']
+
+
+def country_years(rows: int):
+    '''
+    the (Country, Year) grid needed for about rows yield rows, years are
+    extended past the real history once every country is used
+    '''
+    pairs = math.ceil(rows / len(CROPS))
+    n_countries = min(len(COUNTRIES), pairs)
+    n_years = math.ceil(pairs / n_countries)
+    countries = np.repeat(np.array(COUNTRIES[:n_countries], dtype=object), n_years)
+    years = np.tile(np.arange(FIRST_YEAR, FIRST_YEAR + n_years), n_countries)
+    return countries, years
+
+
+def fao_frame(countries, years, item, unit, values) -> pd.DataFrame:
+    return pd.DataFrame({
+        'Domain Code': 'QC', 'Domain': 'Crops', 'Area Code': 0, 'Country': countries, 'Element Code': 0,
+        'Element': 'Yield' if unit == 'hg/ha' else 'Use', 'Item Code': 0, 'Item': item,
+        'Year Code': years, 'Year': years, 'Unit': unit, 'Value': values,
+    }, columns=FAO_HEADER)
+
+
+def write_rain(path, countries, years, rng) -> None:
+    '''
+    rain.csv is written by hand so names with commas stay unquoted like the real feed
+    '''
+    rainfall = rng.integers(50, 3500, len(years)).astype(str).astype(object)
+    rainfall[rng.random(len(years)) < SENTINEL_SHARE] = '..'
+    lines = pd.Series(countries) + ',' + pd.Series(years).astype(str) + ',' + pd.Series(rainfall)
+    with open(path, 'w', encoding='utf-8') as outfile:
+        outfile.write('country,year,average_rain_fall_mm_per_year\n')
+        outfile.write('\n'.join(lines) + '\n')
+
+
+def generate_datasets(data_dir: str, rows: int, seed: int = 0) -> str:
+    '''
+    write synthetic rain, temperature, pesticide and yield csv files with about
+    rows yield rows under data_dir/data, the layout main expects
+
+    Returns:
+    the data directory
+    '''
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.join(data_dir, 'data'), exist_ok=True)
+    countries, years = country_years(rows)
+
+    write_rain(os.path.join(data_dir, 'data', 'rain.csv'), countries, years, rng)
+
+    # utf-8 names decoded as latin-1, read back with ISO-8859-1 they give CÃ´te d'Ivoire
+    mojibake = np.array([name.encode('utf-8').decode('latin-1') for name in countries], dtype=object)
+    temperature = pd.DataFrame({
+        'Year': np.repeat(years, STATIONS),
+        'Country': np.repeat(mojibake, STATIONS),
+        'avg_temp (°C)': rng.normal(20, 7, len(years) * STATIONS).round(2),
+    })
+    temperature.to_csv(os.path.join(data_dir, 'data', 'temperature.csv'), index=False, encoding='ISO-8859-1')
+
+    pesticide = fao_frame(countries, years, 'Pesticides (total)', 'tonnes', rng.gamma(2, 5000, len(years)).round(2))
+    pesticide.to_csv(os.path.join(data_dir, 'data', 'pesticides_usage.csv'), index=False, sep=';')
+
+    crops = np.tile(np.array(CROPS, dtype=object), len(years))
+    yields = fao_frame(np.repeat(countries, len(CROPS)), np.repeat(years, len(CROPS)), crops, 'hg/ha',
+                       rng.integers(5_000, 400_000, len(crops)))
+    yields.to_csv(os.path.join(data_dir, 'data', 'yield.csv'), index=False, sep=';')
+    return data_dir
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate synthetic input csv files for the pipeline")
+    parser.add_argument('data_dir')
+    parser.add_argument('--rows', type=int, default=10_000, help="approximate number of yield rows")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_datasets(args.data_dir, args.rows, args.seed)
@@ -1,71 +1,324 @@
+import argparse
+import os
 from pipeline.utils.constants import *
-from pipeline.writer.writer import *
-from pipeline.processors.processor import *
-from pipeline.reader.reader import *
 
+# the stage modules are imported where they are used, so that --help and the
+# argument errors do not wait for pandas, plotly and sklearn
 
-def main():
+
+ROLES = ['analyst', 'breeder']
+
+
+def resolve_continents(sources, continent_file=CONTINENT_FILE, rules=None):
+    '''
+    resolves the continent of every distinct cleaned country name of the sources,
+    the mapping is its own stage so that the shared continent table, which grows
+    with every new country of any dataset, does not key the combine stage
+    '''
+    import pandas as pd
+    from pipeline.processors.processor import CleaningRules, TranformRawData
+
+    rules = CleaningRules((rules or CleaningRules.from_file(CLEANING_RULES_FILE)).rules)
+    names = pd.concat([df[['Country']].drop_duplicates().astype(object) for df in sources.values()], ignore_index=True)
+    countries = rules.apply(names.drop_duplicates())['Country'].dropna().unique()
+    return TranformRawData(None, None, continent_file).get_continent_mapping(countries)
+
+
+def combine_and_transform(sources, continent_file=CONTINENT_FILE, rules=None, continents=None):
+    '''
+    combines the cleaned sources on Country and Year and applies the data transformation,
+    continents is the mapping of resolve_continents, looked up here when not given
     '''
-    runs the all scripts importing data to report building with visuals
+    from pipeline.processors.processor import CleaningRules, CombineSources, TranformRawData
+
+    rules = rules or CleaningRules.from_file(CLEANING_RULES_FILE)
+    columns = {
+        'pesticide': {'Value': 'pest_value (tonnes)'},
+        'rain': {'average_rain_fall_mm_per_year': 'average_rain_fall (mm/year)'},
+        'temperature': {'avg_temp (°C)': 'avg_temp (°C)'},
+        'yield': {'Item': 'crop_types', 'Value': 'yield_value (hg/ha)'},
+    }
+    column_order = ['Country', 'Year', 'crop_types', 'avg_temp (°C)', 'average_rain_fall (mm/year)',
+                    'pest_value (tonnes)', 'yield_value (hg/ha)']
+    combine_data = CombineSources(sources, columns, ['Country', 'Year'])
+    final_agric_data = rules.apply(combine_data.merge(column_order))
+    for name, counts in combine_data.get_merge_report().items():
+        print(f"Rows of {name} without a match in the other sources (dropped): {counts['dropped']} of {counts['rows']}")
+
+    # Data tranformation
+    transform_data = TranformRawData(final_agric_data, 'average_rain_fall (mm/year)', continent_file)
+    return transform_data.map_continent(continents)
+
+
+def build_pipeline(roles, paths=DATA_PATHS, workers=RENDER_WORKERS, incremental=INCREMENTAL, skip_model=False,
+                   backend='pandas', formats=FIGURE_FORMATS):
     '''
+    expresses the pipeline from reading data to report building as a graph of stages,
+    all the roles share one loaded dataset and one aggregation pass
+    '''
+    from pipeline.processors.duckdb_backend import DuckDBPipeline
+    from pipeline.processors.incremental import IncrementalStore
+    from pipeline.processors.processor import CleaningRules, InitialPreprocessingData
+    from pipeline.reader.reader import read_cached, read_csv_file, read_rain_data, read_temp_file
+    from pipeline.utils.dag import StageGraph
+
+    input_paths = {name: paths[name] for name in ['pesticide', 'rain', 'temperature', 'yield']}
+    state = {'affected': None, 'changes': None, 'aggregates': None}
+    graph = StageGraph(paths['checkpoints'], workers=max(workers, 4))
+    rules = CleaningRules.from_file(CLEANING_RULES_FILE)
+
+    if backend == 'duckdb':
+        # out-of-core: duckdb scans, cleans and joins the csv files and answers the
+        # report aggregations, pandas only ever holds a sample of the merged rows
+        def combine():
+            database = DuckDBPipeline(paths, rules)
+            print("Merged rows:", database.build())
+            print("Cleaning rules applied (rows touched):", rules.get_report())
+            state['aggregates'] = database
+            return database.sample()
+
+        graph.add('combine', combine, inputs=list(input_paths.values()),
+                  params={'rules': rules.rules, 'overrides': CONTINENT_OVERRIDES})
+        return add_report_stages(graph, roles, paths, workers, incremental, skip_model, state, formats)
+
     # reading data
-    df_rain = read_rain_file(PATH_RAIN_FILE,NEW_RAIN_FILE)
-    df_yield = read_csv_file(PATH_YIELD_FILE , delimiter=";")
-    df_temperature = read_temp_file(PATH_TEMPERATURE_FILE, encoding='ISO-8859-1')
-    df_rain_2 = read_newrain_file(NEW_RAIN_FILE)
-    df_pesticide = read_csv_file(PATH_PESTICIDE_FILE, delimiter=";")
+    graph.add('read_rain', lambda: read_cached(read_rain_data, paths['rain'], paths['cache'], schema=RAIN_SCHEMA, na_values=NA_VALUES))
+    graph.add('read_yield', lambda: read_cached(read_csv_file, paths['yield'], paths['cache'], delimiter=";", schema=YIELD_SCHEMA))
+    graph.add('read_temperature', lambda: read_cached(read_temp_file, paths['temperature'], paths['cache'], encoding='ISO-8859-1', schema=TEMPERATURE_SCHEMA))
+    graph.add('read_pesticide', lambda: read_cached(read_csv_file, paths['pesticide'], paths['cache'], delimiter=";", schema=PESTICIDE_SCHEMA))
+
+
+    # the continent of each country, the combine stage is keyed on this mapping
+    def continents(df_pesticide, df_rain_2, df_temperature, df_yield):
+        sources = [df_pesticide, df_rain_2.rename(columns={'country': 'Country'}), df_temperature, df_yield]
+        return resolve_continents(dict(enumerate(sources)), paths['continents'], rules)
+
+    graph.add('continents', continents, ['read_pesticide', 'read_rain', 'read_temperature', 'read_yield'],
+              checkpoint='object', inputs=list(input_paths.values()),
+              params={'rules': rules.rules, 'overrides': CONTINENT_OVERRIDES})
+
+    # data preprocessing (renaming, cleaning and combining data)
+    def combine(df_pesticide, df_rain_2, df_temperature, df_yield, continent_map):
+        def build(sources):
+            return combine_and_transform(sources, paths['continents'], rules, continent_map)
+
+        process_data = InitialPreprocessingData(df_temperature,df_rain_2)
+        df_rain_2 = process_data.rename_columns({'country': 'Country', 'year': 'Year'})
+        sources = {'pesticide': df_pesticide, 'rain': df_rain_2, 'temperature': df_temperature, 'yield': df_yield}
+        sources = {name: rules.apply(df) for name, df in sources.items()}
+        if not incremental:
+            transform_agric_data = build(sources)
+        else:
+            # only the Country/Year keys whose rows changed in a source are merged again
+            store = IncrementalStore(paths['store'])
+            transform_agric_data, state['affected'] = store.update(sources, input_paths, build)
+            state['changes'] = store.added, store.removed
+        print("Cleaning rules applied (rows touched):", rules.get_report())
+        return transform_agric_data
+
+    graph.add('combine', combine, ['read_pesticide', 'read_rain', 'read_temperature', 'read_yield', 'continents'],
+              checkpoint=None if incremental else 'frame', inputs=list(input_paths.values()), params={'rules': rules.rules})
+    return add_report_stages(graph, roles, paths, workers, incremental, skip_model, state, formats)
+
+
+def add_report_stages(graph, roles, paths, workers, incremental, skip_model, state, formats):
+    '''
+    adds the report, training and model plot stages on top of the combine stage
+    '''
+    from pipeline.processors.processor import RfPredictionModel
+    from pipeline.writer.writer import REPORT_AGGREGATIONS, AggregationCache, FigureRenderer, ModelPlot, Report
+
     features_column=["avg_temp (°C)","average_rain_fall (mm/year)", "pest_value (tonnes)"]
     target_column = "yield_value (hg/ha)"
-    
-    
-    # data preprocessing (renaming and combining data)
-    
-    process_data = InitialPreprocessingData(df_temperature,df_rain_2)
-    df_temperature = process_data.replace_value('Country', "CÃ´te D'Ivoire", "Côte D'Ivoire" )
-    df_rain_2 = process_data.rename_columns({'country': 'Country', 'year': 'Year'})
- 
-    df = merge_data(df_pesticide,df_rain_2,['Country', 'Year'])
-    df = merge_data(df,df_temperature,['Country', 'Year'])
-    df = merge_data(df,df_yield,['Country', 'Year'])
-    
-    
-    # preprocessing combined data
-    combined_data = FinalDataColumns(df)
-    columns = ['Country', 'Year', 'Item_y', 'avg_temp (°C)','average_rain_fall_mm_per_year', 'Value_x','Value_y']
-    final_raw_agric_data = combined_data.select_columns(columns=columns)
-    
-    renamed_cobined_data = renamedCombinedData(final_raw_agric_data)
-    columns_mapping = {'Item_y': 'crop_types','average_rain_fall_mm_per_year': 'average_rain_fall (mm/year)',
-    'Value_x': 'pest_value (tonnes)','Value_y': 'yield_value (hg/ha)'
-    } 
-    final_agric_data = renamed_cobined_data.rename_final_raw_data_columns(columns_mapping)
-    
 
-    
-    # Data tranformation
-    transform_data = TranformRawData(final_agric_data, 'average_rain_fall (mm/year)')
-    transform_agric_data = transform_data.map_continent()
-    transform_agric_data = transform_data.replace_column_data()
-    
-    
+    # Generate reports for all the roles
+    def report(transform_agric_data):
+        affected = state['affected']
+        if affected is not None and affected.empty:
+            print("No new data since the last run, the report is up to date.")
+            return
+        os.makedirs(paths['figures'], exist_ok=True)
+        renderer = FigureRenderer(workers, formats, os.path.join(paths['figures'], 'report.html'), 'Crop yield report')
+        # only an incremental run keeps the partition statistics it updates next time
+        aggregates = state['aggregates'] or AggregationCache(transform_agric_data, REPORT_AGGREGATIONS, partitioned=incremental)
+        if affected is not None:
+            aggregates.restore(paths['aggregates'], *state['changes'])
+        report = Report(transform_agric_data, renderer, aggregates, paths['figures'])
+        for role in roles:
+            report.generate(user_type=role)
+        if incremental:
+            aggregates.save(paths['aggregates'])
+        return renderer.render()
+
+    graph.add('report', report, ['combine'], params={'roles': sorted(roles), 'figures': paths['figures'], 'formats': formats})
+    if skip_model:
+        return graph
+
+
     # Train and Evaluate Model
-    
-    rf_model = RfPredictionModel(transform_agric_data, features_column, target_column)
-    rf_model.train_and_evaluate()
-    model_results = rf_model.get_model_results()
-    
-   
-    
-    # Generate reports based on user input
-    user_type = input("Enter user type (analyst or breeder): ")
-    
-    report = Report(transform_agric_data)
-    report.generate(user_type=user_type)
-    
-    plot = ModelPlot(model_results)
-    plot.plot_feature_importance()
-    plot.plot_actual_vs_actual()
-        
+    def train(transform_agric_data):
+        rf_model = RfPredictionModel(transform_agric_data, features_column, target_column)
+        rf_model.train_or_load(paths['models'])
+        return rf_model.get_model_results()
+
+    def model_plots(model_results):
+        os.makedirs(paths['figures'], exist_ok=True)
+        renderer = FigureRenderer(workers, formats, os.path.join(paths['figures'], 'model.html'), 'Yield model')
+        plot = ModelPlot(model_results, renderer, paths['figures'])
+        plot.plot_feature_importance()
+        plot.plot_actual_vs_actual()
+        return renderer.render()
+
+    graph.add('train', train, ['combine'], checkpoint='object')
+    graph.add('model_plots', model_plots, ['train'], params={'figures': paths['figures'], 'formats': formats})
+    return graph
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='agri_analyser', description="Crop yield reporting and prediction pipeline")
+    parser.add_argument('--role', default='analyst',
+                        help="comma separated report roles out of analyst, breeder (default: analyst)")
+    parser.add_argument('--data-dir', nargs='+', default=[DATA_DIR],
+                        help="directory holding the data/ folder with the input csv files, several run as a batch")
+    parser.add_argument('--manifest', default=None,
+                        help="json or text file listing the data directories to run as a batch")
+    parser.add_argument('--output-dir', default=None,
+                        help="directory for figures and reports (default: <data-dir>/output), one folder per dataset in a batch")
+    parser.add_argument('--jobs', type=int, default=BATCH_JOBS,
+                        help="datasets processed at once in a batch")
+    parser.add_argument('--memory-budget', default=None,
+                        help="memory the datasets running at once in a batch may use together, e.g. 8GB")
+    parser.add_argument('--shared-dir', default=None,
+                        help="continent table and model cache, shared by the datasets of a batch (default: <output-dir>/shared "
+                             "in a batch, or shared/ in the common parent of the data dirs without --output-dir)")
+    parser.add_argument('--stages', default=None,
+                        help="comma separated stages to run with what they need (default: all)")
+    parser.add_argument('--format', default=','.join(FIGURE_FORMATS),
+                        help="comma separated figure outputs out of html, png (default: html, png needs kaleido)")
+    parser.add_argument('--workers', type=int, default=RENDER_WORKERS,
+                        help="worker processes used to export png figures")
+    parser.add_argument('--skip-model', action='store_true',
+                        help="do not train the model nor plot its results")
+    parser.add_argument('--incremental', action='store_true', default=INCREMENTAL,
+                        help="only reprocess the (Country, Year) keys added, revised or removed since the last run")
+    parser.add_argument('--backend', choices=['pandas', 'duckdb'], default='pandas',
+                        help="duckdb merges and aggregates out-of-core for data larger than memory (default: pandas)")
+    parser.add_argument('--rerun', metavar='STAGE',
+                        help="rerun a single stage, ignoring its checkpoint, with what it and the --stages need")
+    parser.add_argument('--log-file', default=None,
+                        help="write the json stage records to this file instead of stderr")
+    parser.add_argument('--run-report', default=None,
+                        help="json run report with the timing, rows and memory of every call (default: <output-dir>/run_report.json)")
+    parser.add_argument('--metrics-file', default=None,
+                        help="write the stage totals as an OpenMetrics textfile")
+    parser.add_argument('--profile', default=None,
+                        help="dump a profile of the run to this file")
+    parser.add_argument('--profiler', choices=['cprofile', 'pyinstrument'], default='cprofile',
+                        help="profiler used with --profile (default: cprofile)")
+    args = parser.parse_args(argv)
+
+    args.role = [role.strip() for role in args.role.split(',') if role.strip()]
+    unknown = [role for role in args.role if role not in ROLES]
+    if unknown or not args.role:
+        parser.error(f"--role expects a comma separated list out of {ROLES}, got {args.role}")
+    if args.backend == 'duckdb' and args.incremental:
+        parser.error("--incremental is only supported with the pandas backend")
+    args.format = [fmt.strip() for fmt in args.format.split(',') if fmt.strip()]
+    if not args.format or set(args.format) - {'html', 'png'}:
+        parser.error(f"--format expects a comma separated list out of ['html', 'png'], got {args.format}")
+    args.stages = [stage.strip() for stage in args.stages.split(',')] if args.stages else None
+    if args.stages or args.rerun:
+        # the stage names only depend on the backend and --skip-model, not on the data
+        stages = build_pipeline(args.role, DATA_PATHS, skip_model=args.skip_model, backend=args.backend).stages
+        unknown = [stage for stage in (args.stages or []) + ([args.rerun] if args.rerun else []) if stage not in stages]
+        if unknown:
+            parser.error(f"unknown stages {unknown}, expected names out of {list(stages)}")
+    if args.jobs < 1:
+        parser.error(f"--jobs expects at least 1, got {args.jobs}")
+    args.datasets = [{'data_dir': data_dir} for data_dir in args.data_dir]
+    if args.manifest is not None:
+        from pipeline.utils.batch import read_manifest
+        try:
+            args.datasets = read_manifest(args.manifest)
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            parser.error(f"cannot read the manifest {args.manifest}: {error}")
+        if not args.datasets:
+            parser.error(f"the manifest {args.manifest} lists no data directories")
+    if args.memory_budget is not None:
+        from pipeline.utils.batch import parse_memory
+        try:
+            args.memory_budget = parse_memory(args.memory_budget)
+        except ValueError as error:
+            parser.error(str(error))
+    return args
+
+
+def run_dataset(args, data_dir, output_dir=None, shared_dir=None):
+    '''
+    runs the all scripts importing data to report building with visuals for one data directory
+    '''
+    import pandas as pd
+    from pipeline.utils.instrumentation import RUN_REPORT, configure_logging, profile_run
+    from pipeline.utils.memory import format_memory_report
+
+    configure_logging(path=args.log_file)
+    # a process running several datasets writes a report per run, not a growing one
+    RUN_REPORT.clear()
+    paths = get_data_paths(data_dir, output_dir, shared_dir)
+    graph = build_pipeline(args.role, paths, args.workers, args.incremental, args.skip_model,
+                           args.backend, args.format)
+    # the stages share column data between frames instead of copying, a frame
+    # is only copied when it is written to
+    with pd.option_context('mode.copy_on_write', True), profile_run(args.profile, args.profiler):
+        if args.rerun:
+            # the rerun stage is added to the --stages targets, not run instead of them
+            graph.run(targets=(args.stages or []) + [args.rerun], rerun=[args.rerun])
+        else:
+            graph.run(targets=args.stages)
+    print(format_memory_report(graph.memory_report))
+
+    os.makedirs(paths['figures'], exist_ok=True)
+    RUN_REPORT.write_json(args.run_report or os.path.join(paths['figures'], 'run_report.json'))
+    if args.metrics_file:
+        RUN_REPORT.write_openmetrics(args.metrics_file)
+
+
+def run_batch_job(job):
+    '''
+    runs one dataset of a batch in a pool worker, the log, metrics and profile
+    files go to the output folder of the dataset
+    '''
+    args = job['args']
+    figures = get_data_paths(job['data_dir'], job['output_dir'])['figures']
+    for option in ['log_file', 'run_report', 'metrics_file', 'profile']:
+        if getattr(args, option):
+            setattr(args, option, os.path.join(figures, os.path.basename(getattr(args, option))))
+    os.makedirs(figures, exist_ok=True)
+    run_dataset(args, job['data_dir'], job['output_dir'], job['shared_dir'])
+
+
+def main(argv=None):
+    '''
+    runs the pipeline for the data directory, or for every dataset of a batch
+    '''
+    args = parse_args(argv)
+    if args.manifest is None and len(args.datasets) == 1:
+        return run_dataset(args, args.data_dir[0], args.output_dir, args.shared_dir)
+
+    from pipeline.utils.batch import BatchRunner, dataset_jobs, default_shared_dir
+
+    shared_dir = args.shared_dir or default_shared_dir(args.datasets, args.output_dir)
+    jobs = dataset_jobs(args.datasets, args.output_dir)
+    # the figure export processes are split between the datasets running at once
+    args.workers = max(1, args.workers // min(args.jobs, len(jobs)))
+    for job in jobs:
+        job.update(args=args, shared_dir=shared_dir)
+
+    results = BatchRunner(run_batch_job, args.jobs, args.memory_budget).run(jobs)
+    failed = [name for name, status in results.items() if status != 'ok']
+    if failed:
+        raise SystemExit(f"{len(failed)} of {len(jobs)} datasets failed: {failed}")
+
     
 if __name__=="__main__":
-    main()
\ No newline at end of file
+    main()
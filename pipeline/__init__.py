@@ -1,4 +1,28 @@
-from .utils.constants import *
-from .writer.writer import *
-from .processors.processor import *
-from .reader.reader import *
\ No newline at end of file
+import importlib
+
+# the submodules are imported on first use of one of their names, so that a
+# reader-only script does not pay for plotly, sklearn and pycountry at startup
+SUBMODULES = [
+    'utils.constants',
+    'utils.memory',
+    'utils.instrumentation',
+    'reader.reader',
+    'utils.dag',
+    'utils.batch',
+    'processors.incremental',
+    'processors.processor',
+    'processors.duckdb_backend',
+    'writer.writer',
+]
+
+
+def __getattr__(name):
+    if name.startswith('__'):
+        raise AttributeError(name)
+    for submodule in SUBMODULES:
+        module = importlib.import_module(f'{__name__}.{submodule}')
+        if hasattr(module, name):
+            value = getattr(module, name)
+            globals()[name] = value
+            return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
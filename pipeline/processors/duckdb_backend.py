@@ -0,0 +1,239 @@
+import os
+from typing import Dict, List
+import pandas as pd
+from pipeline.processors.processor import CleaningRules, TranformRawData
+from pipeline.utils.constants import DUCKDB_MEMORY_LIMIT, SAMPLE_ROWS
+from pipeline.utils.instrumentation import instrument
+
+SQL_AGGREGATES = {'mean': 'avg', 'sum': 'sum', 'min': 'min', 'max': 'max', 'count': 'count',
+                  'std': 'stddev_samp', 'median': 'median'}
+SQL_TYPES = {'int16': 'SMALLINT', 'int32': 'INTEGER', 'int64': 'BIGINT', 'float32': 'REAL', 'float64': 'DOUBLE'}
+STRING_RULES = ['replace', 'mojibake']          # applied to the distinct values in pandas
+NUMERIC_COLUMNS = ['Year', 'avg_temp (°C)', 'average_rain_fall (mm/year)', 'pest_value (tonnes)', 'yield_value (hg/ha)']
+
+
+def quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def literal(value) -> str:
+    if value is None:
+        return 'NULL'
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return repr(value)
+
+
+def rule_expression(expression: str, rule: Dict) -> str:
+    '''
+    translate a numeric cleaning rule into a sql expression wrapping expression
+    '''
+    if rule['type'] == 'sentinel':
+        values = ', '.join(literal(str(value)) for value in rule['values'])
+        # compared and returned as text, a following cast rule gives the column its type
+        return (f"CASE WHEN {expression} IS NULL OR CAST({expression} AS VARCHAR) IN ({values}) "
+                f"THEN CAST({literal(rule.get('fill'))} AS VARCHAR) ELSE CAST({expression} AS VARCHAR) END")
+    if rule['type'] == 'cast':
+        return f"TRY_CAST({expression} AS {SQL_TYPES.get(rule.get('dtype'), 'DOUBLE')})"
+    if rule['type'] == 'range':
+        lower, upper = rule.get('min'), rule.get('max')
+        if rule.get('action', 'nan') == 'clip':
+            if lower is not None:
+                expression = f"GREATEST({expression}, {lower})"
+            if upper is not None:
+                expression = f"LEAST({expression}, {upper})"
+            return expression
+        conditions = [f"{expression} < {lower}" if lower is not None else None,
+                      f"{expression} > {upper}" if upper is not None else None]
+        return f"CASE WHEN {' OR '.join(c for c in conditions if c)} THEN NULL ELSE {expression} END"
+    raise ValueError(f"rule type '{rule['type']}' has no sql translation")
+
+
+
+class DuckDBPipeline:
+    
+    def __init__(self, paths: Dict[str, str], rules: CleaningRules, memory_limit: str = DUCKDB_MEMORY_LIMIT,
+                 database: str = None) -> None:
+        '''
+        out-of-core read, clean, merge and aggregate path: the csv files are scanned
+        by duckdb and the merged table lives in a duckdb database file under the
+        cache directory, spilling to disk past memory_limit. Only aggregates and
+        samples come back as pandas frames
+        '''
+        import duckdb
+
+        os.makedirs(paths['cache'], exist_ok=True)
+        self.paths = paths
+        self.rules = rules
+        self.database = database or os.path.join(paths['cache'], 'pipeline.duckdb')
+        self.connection = duckdb.connect(self.database)
+        self.connection.execute(f"SET memory_limit = {literal(memory_limit)}")
+        self.connection.execute(f"SET temp_directory = {literal(os.path.join(paths['cache'], 'duckdb_tmp'))}")
+
+    def query(self, sql: str) -> pd.DataFrame:
+        """
+        Run a query on its own cursor, so stages on different threads can query concurrently.
+        """
+        return self.connection.cursor().execute(sql).df()
+
+    def create_sources(self) -> None:
+        """
+        Lazy views over the four csv files with the final column names, the
+        ragged rain rows are split on their last two commas.
+        """
+        rain, temperature = literal(self.paths['rain']), literal(self.paths['temperature'])
+        pesticide, crop_yield = literal(self.paths['pesticide']), literal(self.paths['yield'])
+        self.connection.execute(f"""
+            CREATE OR REPLACE VIEW rain_lines AS
+            SELECT regexp_extract(line, '^(.*),([^,]*),([^,]*)$', ['country', 'year', 'rain']) AS parts
+            FROM read_csv({rain}, columns = {{'line': 'VARCHAR'}}, delim = '\\x01', quote = '', escape = '', header = true)
+        """)
+        self.connection.execute("""
+            CREATE OR REPLACE VIEW rain AS
+            SELECT CASE WHEN starts_with(parts.country, '"') THEN trim(parts.country, '"')
+                        ELSE replace(parts.country, ',', ' ') END AS Country,
+                   TRY_CAST(parts.year AS SMALLINT) AS Year,
+                   parts.rain AS "average_rain_fall (mm/year)"
+            FROM rain_lines WHERE parts.country <> ''
+        """)
+        self.connection.execute(f"""
+            CREATE OR REPLACE VIEW temperature AS
+            SELECT Country, CAST(Year AS SMALLINT) AS Year, "avg_temp (°C)"
+            FROM read_csv({temperature}, encoding = 'latin-1', quote = '"', header = true)
+        """)
+        self.connection.execute(f"""
+            CREATE OR REPLACE VIEW pesticide AS
+            SELECT Country, CAST(Year AS SMALLINT) AS Year, Value AS "pest_value (tonnes)"
+            FROM read_csv({pesticide}, delim = ';', quote = '"', header = true)
+        """)
+        self.connection.execute(f"""
+            CREATE OR REPLACE VIEW yield AS
+            SELECT Country, CAST(Year AS SMALLINT) AS Year, Item AS crop_types, Value AS "yield_value (hg/ha)"
+            FROM read_csv({crop_yield}, delim = ';', quote = '"', header = true)
+        """)
+
+    def register_mappings(self, sources: List[str]) -> None:
+        """
+        Run the string cleaning rules and the continent lookup on the distinct
+        country names only, and register the small mapping tables in duckdb.
+        """
+        union = ' UNION ALL '.join(f"SELECT Country FROM {source}" for source in sources)
+        countries = self.query(f"SELECT Country, count(*) AS rows FROM ({union}) GROUP BY Country")
+        cleaned = countries
+        for rule in self.rules.rules:
+            if rule['type'] not in STRING_RULES:
+                continue
+            # the report counts source rows, as the pandas path does, not distinct names
+            fixed = CleaningRules([rule]).apply(cleaned)
+            self.rules.report[rule['name']] += int(countries['rows'][fixed['Country'].ne(cleaned['Country'])].sum())
+            cleaned = fixed
+        country_map = pd.DataFrame({'raw': countries['Country'], 'Country': cleaned['Country']})
+
+        continents = TranformRawData(None, None, self.paths['continents']).get_continent_mapping(
+            country_map['Country'].dropna().unique())
+        continent_map = pd.DataFrame(list(continents.items()), columns=['Country', 'Continent'])
+        self.connection.register('country_map', country_map)
+        self.connection.register('continent_map', continent_map)
+
+    @instrument
+    def build(self) -> int:
+        """
+        Clean and join the four sources into the merged table with projection and
+        the cleaning rules pushed into the scan. Every csv file is scanned once into
+        a staged table and the sources are joined once, the merged table keeps the
+        raw values of the cleaned columns until the rule report is counted on them.
+
+        Returns:
+        rows in the merged table
+        """
+        sources = ['pesticide', 'rain', 'temperature', 'yield']
+        self.create_sources()
+        staged = {source: quote(f"staged_{source}") for source in sources}
+        for source in sources:
+            self.connection.execute(f"CREATE OR REPLACE TABLE {staged[source]} AS SELECT * FROM {source}")
+        self.register_mappings(list(staged.values()))
+
+        cleaned = {}
+        for source in sources:
+            cleaned[source] = (f"(SELECT m.Country, s.* EXCLUDE (Country) FROM {staged[source]} s "
+                               f"JOIN country_map m ON s.Country = m.raw)")
+        source_columns = {'Year': 'p.Year', 'crop_types': 'y.crop_types', 'avg_temp (°C)': 't."avg_temp (°C)"',
+                          'average_rain_fall (mm/year)': 'r."average_rain_fall (mm/year)"',
+                          'pest_value (tonnes)': 'p."pest_value (tonnes)"',
+                          'yield_value (hg/ha)': 'y."yield_value (hg/ha)"'}
+        columns = dict(source_columns)
+        raw = {}
+        counted = {}
+        changes = []
+        for rule in self.rules.rules:
+            if rule['type'] in STRING_RULES:
+                continue
+            for column in rule['columns']:
+                if column in columns:
+                    if column not in raw:
+                        raw[column] = quote('raw|' + column)
+                        counted[column] = raw[column]
+                    columns[column] = rule_expression(columns[column], rule)
+                    # the same rule chain over the kept raw value, to count the rows each rule changes
+                    before, counted[column] = counted[column], rule_expression(counted[column], rule)
+                    changes.append(f"count(*) FILTER (WHERE CAST({before} AS VARCHAR) IS DISTINCT FROM "
+                                   f"CAST({counted[column]} AS VARCHAR)) AS {quote(rule['name'] + '|' + column)}")
+        select = ',\n'.join(f"{expression} AS {quote(column)}" for column, expression in columns.items())
+        raw_values = ''.join(f", {source_columns[column]} AS {name}" for column, name in raw.items())
+
+        self.connection.execute(f"""
+            CREATE OR REPLACE TABLE merged AS
+            SELECT p.Country, {select}, c.Continent{raw_values}
+            FROM {cleaned['pesticide']} p
+            JOIN {cleaned['rain']} r ON p.Country = r.Country AND p.Year = r.Year
+            JOIN {cleaned['temperature']} t ON p.Country = t.Country AND p.Year = t.Year
+            JOIN {cleaned['yield']} y ON p.Country = y.Country AND p.Year = y.Year
+            LEFT JOIN continent_map c ON p.Country = c.Country
+        """)
+        for table in staged.values():
+            self.connection.execute(f"DROP TABLE {table}")
+        if changes:
+            # the numeric rules are counted on the joined rows
+            touched = self.connection.execute(f"SELECT {', '.join(changes)} FROM merged").df().iloc[0]
+            for name, count in touched.items():
+                self.rules.report[name.split('|')[0]] += int(count)
+        for column in raw.values():
+            self.connection.execute(f"ALTER TABLE merged DROP COLUMN {column}")
+        return self.connection.execute("SELECT count(*) FROM merged").fetchone()[0]
+
+    def get(self, keys, columns: Dict[str, str]) -> pd.DataFrame:
+        """
+        Same contract as AggregationCache.get, computed out-of-core by duckdb.
+        """
+        keys = list(keys)
+        group = ', '.join(quote(key) for key in keys)
+        aggregates = ', '.join(f"{SQL_AGGREGATES[agg]}({quote(column)}) AS {quote(column)}"
+                               for column, agg in columns.items())
+        return self.query(f"SELECT {group}, {aggregates} FROM merged WHERE {' AND '.join(f'{quote(k)} IS NOT NULL' for k in keys)} "
+                          f"GROUP BY {group} ORDER BY {group}")
+
+    def describe(self) -> pd.DataFrame:
+        """
+        Same layout as pandas describe() for the numeric columns.
+        """
+        rows = {'count': 'count({c})', 'mean': 'avg({c})', 'std': 'stddev_samp({c})', 'min': 'min({c})',
+                '25%': 'quantile_cont({c}, 0.25)', '50%': 'quantile_cont({c}, 0.5)',
+                '75%': 'quantile_cont({c}, 0.75)', 'max': 'max({c})'}
+        select = ', '.join(f"{expression.format(c=quote(column))} AS {quote(column + '|' + stat)}"
+                           for stat, expression in rows.items() for column in NUMERIC_COLUMNS)
+        values = self.query(f"SELECT {select} FROM merged").iloc[0]
+        return pd.DataFrame({column: [float(values[column + '|' + stat]) for stat in rows] for column in NUMERIC_COLUMNS},
+                            index=list(rows))
+
+    def correlations(self, columns) -> pd.DataFrame:
+        """
+        Correlation matrix of the per country means, as AggregationCache.correlations.
+        """
+        return self.get(['Country'], {column: 'mean' for column in columns})[list(columns)].corr()
+
+    @instrument
+    def sample(self, rows: int = SAMPLE_ROWS, seed: int = 0) -> pd.DataFrame:
+        """
+        Pull at most rows of the merged table into pandas, for the row-level plots and the model.
+        """
+        return self.query(f"SELECT * FROM merged USING SAMPLE reservoir({int(rows)} ROWS) REPEATABLE ({int(seed)})")
@@ -0,0 +1,130 @@
+import json
+import os
+from typing import Callable, Dict, List
+import numpy as np
+import pandas as pd
+from pipeline.reader.reader import file_hash
+from pipeline.utils.instrumentation import instrument
+
+
+def key_mask(df: pd.DataFrame, keys: pd.DataFrame) -> np.ndarray:
+    '''
+    mask of the rows of df whose key columns appear in the keys dataframe, the rows
+    are matched on all the keys at once only after a per key prefilter
+    '''
+    columns = list(keys.columns)
+    mask = np.ones(len(df), dtype=bool)
+    for column in columns:
+        mask &= df[column].isin(keys[column].unique()).to_numpy()
+    candidates = pd.MultiIndex.from_frame(df.loc[mask, columns].astype(object))
+    mask[mask] = candidates.isin(pd.MultiIndex.from_frame(keys.astype(object)))
+    return mask
+
+
+
+class IncrementalStore:
+    
+    def __init__(self, store_dir: str, keys: List[str] = None) -> None:
+        '''
+        store_dir holds the last processed merged dataset, the file hash of every
+        input it was built from and a content hash per (Country, Year) key of each input.
+        After an incremental update, added and removed hold the merged rows it wrote and replaced
+        '''
+        self.store_dir = store_dir
+        self.keys = keys or ['Country', 'Year']
+        self.merged_path = os.path.join(store_dir, "merged.parquet")
+        self.watermark_path = os.path.join(store_dir, "watermarks.json")
+        self.added = None
+        self.removed = None
+
+    def key_hash_path(self, name: str) -> str:
+        return os.path.join(self.store_dir, f"keys-{name}.parquet")
+
+    def load(self):
+        """
+        Return the stored merged dataset and watermarks, (None, {}) when nothing is stored yet.
+        """
+        if not (os.path.exists(self.merged_path) and os.path.exists(self.watermark_path)):
+            return None, {}
+        with open(self.watermark_path) as infile:
+            watermarks = json.load(infile)
+        if not all(os.path.exists(self.key_hash_path(name)) for name in watermarks):
+            return None, {}
+        return pd.read_parquet(self.merged_path), watermarks
+
+    def save(self, merged: pd.DataFrame, hashes: Dict[str, str], key_hashes: Dict[str, pd.Series]) -> None:
+        """
+        Store the merged dataset with the file and key hashes of the sources it was built from.
+        """
+        os.makedirs(self.store_dir, exist_ok=True)
+        for name, key_hash in key_hashes.items():
+            key_hash.reset_index().to_parquet(self.key_hash_path(name), index=False)
+        merged.to_parquet(self.merged_path, index=False)
+        with open(self.watermark_path, 'w') as outfile:
+            json.dump({name: {'hash': file_hash} for name, file_hash in hashes.items()}, outfile)
+
+    def key_hashes(self, df: pd.DataFrame) -> pd.Series:
+        """
+        Content hash of the rows of every key, independent of the row order.
+        """
+        rows = pd.util.hash_pandas_object(df[sorted(df.columns)], index=False)
+        key_hash = rows.groupby([df[key] for key in self.keys], observed=True, sort=False).sum().rename('hash')
+        # keys as plain objects, so categorical and stored keys compare equal
+        key_hash.index = pd.MultiIndex.from_frame(key_hash.index.to_frame(index=False).astype(object))
+        return key_hash
+
+    def changed_keys(self, name: str, key_hash: pd.Series) -> pd.DataFrame:
+        """
+        Keys of a source that were added, removed or whose rows differ from the stored ones.
+        """
+        stored = pd.read_parquet(self.key_hash_path(name))
+        stored = stored.set_index([stored[key].astype(object) for key in self.keys])['hash']
+        both = pd.concat([stored.rename('stored'), key_hash.rename('current')], axis=1)
+        changed = both[both['stored'].ne(both['current'])]
+        return changed.index.to_frame(index=False, name=self.keys)
+
+    @instrument
+    def update(self, sources: Dict[str, pd.DataFrame], paths: Dict[str, str],
+               build: Callable[[Dict[str, pd.DataFrame]], pd.DataFrame]):
+        """
+        Bring the stored dataset up to date with the sources, build turns a set of
+        sources into processed merged rows.
+
+        Every (Country, Year) key whose rows changed in a source, whether appended,
+        revised in place or removed, is rebuilt from all the sources and replaces
+        its stored rows. Sources whose file did not change are not hashed.
+
+        Returns:
+        the merged dataset and the affected keys, None when everything was rebuilt
+        """
+        self.added, self.removed = None, None
+        hashes = {name: file_hash(path) for name, path in paths.items()}
+        merged, watermarks = self.load()
+        if merged is None or set(watermarks) != set(sources):
+            return self.rebuild(sources, hashes, build), None
+
+        changed = [name for name in sources if watermarks[name]['hash'] != hashes[name]]
+        key_hashes = {name: self.key_hashes(sources[name]) for name in changed}
+        deltas = [self.changed_keys(name, key_hashes[name]) for name in changed]
+        if not any(len(delta) for delta in deltas):
+            if changed:
+                self.save(merged, hashes, key_hashes)
+            self.added, self.removed = merged.iloc[:0], merged.iloc[:0]
+            return merged, pd.DataFrame(columns=self.keys)
+
+        affected = pd.concat([delta.astype(object) for delta in deltas]).drop_duplicates()
+        self.added = build({name: df[key_mask(df, affected)] for name, df in sources.items()})
+        replaced = key_mask(merged, affected)
+        self.removed = merged[replaced]
+        merged = pd.concat([merged[~replaced], self.added], ignore_index=True)
+        self.save(merged, hashes, key_hashes)
+        return merged, affected
+
+    def rebuild(self, sources: Dict[str, pd.DataFrame], hashes: Dict[str, str],
+                build: Callable[[Dict[str, pd.DataFrame]], pd.DataFrame]) -> pd.DataFrame:
+        """
+        Build the merged dataset from the full sources and store it.
+        """
+        merged = build(sources)
+        self.save(merged, hashes, {name: self.key_hashes(df) for name, df in sources.items()})
+        return merged
@@ -1,40 +1,214 @@
+import hashlib
+import json
+import os
+import warnings
+import joblib
+import numpy as np
 import pandas as pd
-import pycountry
-import pycountry_convert as pc
-from typing import Dict
-from sklearn.metrics import mean_squared_error
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split
+from functools import reduce
+from typing import TYPE_CHECKING, Dict, List
+from joblib import Parallel, delayed
+from pipeline.utils.constants import CONTINENT_OVERRIDES
+from pipeline.utils.instrumentation import instrument
 
+# sklearn, pycountry and pycountry_convert take most of the import time of the
+# package, they are imported by the methods that use them
+if TYPE_CHECKING:
+    from sklearn.ensemble import RandomForestRegressor
+
+
+# forest hyperparameters, warm_start_step grows the forest in rounds of that
+# many trees and stops early once the out-of-bag score gains less than oob_tolerance
+DEFAULT_RF_PARAMS = {
+    'n_estimators': 100,
+    'n_jobs': -1,
+    'max_depth': None,
+    'max_samples': None,
+    'min_samples_leaf': 1,
+    'warm_start_step': None,
+    'oob_tolerance': 1e-3,
+}
+FOREST_PARAMS = ['n_estimators', 'n_jobs', 'max_depth', 'max_samples', 'min_samples_leaf']
+PREDICT_CHUNK_SIZE = 100_000
+
+# search space for search_hyperparameters
+RF_PARAM_DISTRIBUTIONS = {
+    'n_estimators': [50, 100, 200, 400],
+    'max_depth': [None, 8, 16, 32],
+    'max_samples': [None, 0.5, 0.8],
+    'min_samples_leaf': [1, 2, 5, 10],
+}
+CV_SCORING = {'r2': 'r2', 'mse': 'neg_mean_squared_error'}
+MIN_SHARD_ROWS = 20                   # shards with fewer rows are not trained
 
 
 class InitialPreprocessingData:
+    '''
+    the processing classes never modify the frames they are given, each step
+    returns a new frame, which shares the untouched columns when pandas runs in
+    copy-on-write mode as the pipeline run does
+    '''
     
     def __init__(self, df, df1) -> None:
         self.df = df
         self.df1 = df1  
         
+    @instrument
     def rename_columns(self, list_columns: Dict[str, str]):
         '''
         this function helps rename the columns Country and Year
         for rain dataset to ease merging of the data
         '''
-        self.df1.rename(columns=list_columns, inplace=True)
+        self.df1 = self.df1.rename(columns=list_columns)
         
         return self.df1
 
+    @instrument
     def replace_value(self, column, value, new_value):
         '''
         this function permit the modification of country value
         cote d'Ivoire for the temperature dataset
         '''
         
-        self.df[column] = self.df[column].replace(value, new_value)
+        self.df = self.df.assign(**{column: self.df[column].replace(value, new_value)})
         
         return self.df
 
 
 
+def fix_mojibake(value):
+    '''
+    repair a utf-8 string that was decoded as ISO-8859-1, other values are returned unchanged
+    '''
+    if not isinstance(value, str):
+        return value
+    try:
+        return value.encode('latin-1').decode('utf-8')
+    except UnicodeError:
+        return value
+
+
+def remap_values(series: pd.Series, func):
+    '''
+    apply func to the distinct values of a column only and remap the codes,
+    categorical columns stay categorical
+
+    Returns:
+    the new column and the number of rows whose value changed
+    '''
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+    else:
+        codes, uniques = pd.factorize(series)
+    fixed = pd.Index([func(value) for value in uniques], dtype=object)
+    changed = np.flatnonzero(fixed.to_numpy() != uniques.to_numpy(dtype=object))
+    if len(changed) == 0:
+        return series, 0
+
+    remap, new_uniques = pd.factorize(fixed)
+    new_codes = np.where(codes >= 0, remap[codes], -1)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        values = pd.Categorical.from_codes(new_codes, new_uniques)
+    else:
+        values = np.append(new_uniques.to_numpy(dtype=object), np.nan)[new_codes]     # code -1 picks the trailing NaN
+    return pd.Series(values, index=series.index, name=series.name), int(np.isin(codes, changed).sum())
+
+
+def replace_rule(series: pd.Series, rule: Dict):
+    mapping = rule['mapping']
+    return remap_values(series, lambda value: mapping.get(value, value))
+
+
+def mojibake_rule(series: pd.Series, rule: Dict):
+    return remap_values(series, fix_mojibake)
+
+
+def sentinel_rule(series: pd.Series, rule: Dict):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype(object)
+    missing = series.isin(rule['values']) | series.isna()
+    return series.mask(missing, rule.get('fill')), int(missing.sum())
+
+
+def cast_rule(series: pd.Series, rule: Dict):
+    numeric = pd.to_numeric(series, errors='coerce')
+    coerced = int((numeric.isna() & series.notna()).sum())
+    dtype = rule.get('dtype')
+    if dtype is not None:
+        if pd.api.types.is_integer_dtype(np.dtype(dtype)) and numeric.isna().any():
+            raise ValueError(f"rule '{rule['name']}': column '{series.name}' has missing values and cannot be cast to {dtype}")
+        numeric = numeric.astype(dtype)
+    return numeric, coerced
+
+
+def range_rule(series: pd.Series, rule: Dict):
+    lower, upper = rule.get('min'), rule.get('max')
+    if not pd.api.types.is_numeric_dtype(series):
+        series = pd.to_numeric(series, errors='coerce')
+    outside = pd.Series(False, index=series.index)
+    if lower is not None:
+        outside |= series < lower
+    if upper is not None:
+        outside |= series > upper
+    if rule.get('action', 'nan') == 'clip':
+        return series.clip(lower, upper), int(outside.sum())
+    return series.mask(outside), int(outside.sum())
+
+
+CLEANING_RULE_TYPES = {
+    'replace': replace_rule,
+    'mojibake': mojibake_rule,
+    'sentinel': sentinel_rule,
+    'cast': cast_rule,
+    'range': range_rule,
+}
+
+
+
+class CleaningRules:
+    
+    def __init__(self, rules: List[Dict]) -> None:
+        '''
+        rules are applied in order, each one is a dict with a name, a type out of
+        CLEANING_RULE_TYPES and the columns it applies to
+        '''
+        unknown = [rule['name'] for rule in rules if rule['type'] not in CLEANING_RULE_TYPES]
+        if unknown:
+            raise ValueError(f"unknown cleaning rule types in rules {unknown}")
+        self.rules = rules
+        self.report = {rule['name']: 0 for rule in rules}
+
+    @classmethod
+    def from_file(cls, path: str) -> 'CleaningRules':
+        with open(path, encoding='utf-8') as infile:
+            return cls(json.load(infile)['rules'])
+
+    @instrument
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        '''
+        run every rule on the columns of df it names, each column goes through
+        all its rules before being assigned once. Rules naming absent columns
+        are skipped, so the same rules serve the raw sources and the merged data
+        '''
+        columns = {}
+        for rule in self.rules:
+            for column in rule['columns']:
+                if column not in df.columns:
+                    continue
+                series, touched = CLEANING_RULE_TYPES[rule['type']](columns.get(column, df[column]), rule)
+                columns[column] = series
+                self.report[rule['name']] += touched
+        return df.assign(**columns) if columns else df
+
+    def get_report(self) -> Dict[str, int]:
+        '''
+        rows touched per rule over all the frames cleaned so far
+        '''
+        return self.report
+
+
+
+@instrument
 def merge_data(df1, df2, list_columns):
     '''
     the combine all the data by mering with id country
@@ -44,12 +218,120 @@ def merge_data(df1, df2, list_columns):
 
 
 
+class CombineSources:
+    
+    def __init__(self, sources: Dict[str, pd.DataFrame], columns: Dict[str, Dict[str, str]], keys: List[str]):
+        '''
+        sources are the datasets to join keyed by name, columns maps each source
+        to the {original: final} names of the value columns to keep from it
+        '''
+        self.sources = sources
+        self.columns = columns
+        self.keys = keys
+        self.merge_report = None
+
+    def align_categories(self, frames: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+        '''
+        give the categorical keys the same categories in every frame, so the joins
+        match on the category codes and the keys stay categorical
+        '''
+        for key in self.keys:
+            if not all(isinstance(frame[key].dtype, pd.CategoricalDtype) for frame in frames.values()):
+                continue
+            categories = [frame[key].cat.categories for frame in frames.values()]
+            levels = categories[0].append(categories[1:]).unique()
+            frames = {name: frame.assign(**{key: frame[key].cat.set_categories(levels)})
+                      for name, frame in frames.items()}
+        return frames
+
+    def encode_keys(self, frames: Dict[str, pd.DataFrame]):
+        '''
+        encode the join keys of every frame into a single int64 with levels shared
+        across all frames, rows with a missing key are encoded as -1. Aligned
+        categorical keys use their codes and integer keys their offset from the
+        smallest value, so only other keys are hashed
+
+        Returns:
+        the codes of every frame and the number of possible codes
+        '''
+        encoded = {name: np.zeros(len(frame), dtype=np.int64) for name, frame in frames.items()}
+        missing = {name: np.zeros(len(frame), dtype=bool) for name, frame in frames.items()}
+        size = 1
+        for key in self.keys:
+            columns = {name: frame[key] for name, frame in frames.items()}
+            if all(isinstance(column.dtype, pd.CategoricalDtype) for column in columns.values()):
+                levels = len(next(iter(columns.values())).cat.categories)
+                codes = {name: column.cat.codes.to_numpy().astype(np.int64) for name, column in columns.items()}
+            elif all(pd.api.types.is_integer_dtype(column.dtype) for column in columns.values()):
+                low = min((int(column.min()) for column in columns.values() if len(column)), default=0)
+                high = max((int(column.max()) for column in columns.values() if len(column)), default=-1)
+                levels = high - low + 1
+                codes = {name: column.to_numpy().astype(np.int64) - low for name, column in columns.items()}
+            else:
+                values = pd.Index(np.concatenate([np.asarray(column.unique()) for column in columns.values()]))
+                values = values.dropna().unique()
+                levels = len(values)
+                codes = {name: values.get_indexer(column) for name, column in columns.items()}
+            for name in frames:
+                missing[name] |= codes[name] < 0
+                encoded[name] = encoded[name] * levels + codes[name]
+            size *= max(levels, 1)
+        for name in frames:
+            encoded[name][missing[name]] = -1
+        return encoded, size
+
+    def count_dropped(self, frames: Dict[str, pd.DataFrame]) -> Dict[str, Dict[str, int]]:
+        '''
+        rows of every frame whose key is missing from at least one other frame
+        '''
+        encoded, size = self.encode_keys(frames)
+        if size <= 4 * sum(len(codes) for codes in encoded.values()) + 1024:
+            # dense key space: presence tables instead of sorting the keys
+            common = np.ones(size, dtype=bool)
+            for codes in encoded.values():
+                common &= np.bincount(codes[codes >= 0], minlength=size) > 0
+            kept = {name: int(common[codes[codes >= 0]].sum()) for name, codes in encoded.items()}
+        else:
+            common = reduce(np.intersect1d, [np.unique(codes[codes >= 0]) for codes in encoded.values()])
+            kept = {name: int(np.isin(codes, common).sum()) for name, codes in encoded.items()}
+        return {name: {'rows': len(frame), 'dropped': len(frame) - kept[name]} for name, frame in frames.items()}
+
+    @instrument
+    def merge(self, column_order: List[str] = None) -> pd.DataFrame:
+        '''
+        join all the sources on the shared keys, keeping only the projected columns
+
+        The sources are projected before joining so no suffixed columns are made,
+        and the categorical keys share their categories so the chained inner joins
+        run on the category codes.
+        '''
+        frames = {
+            name: df[self.keys + list(self.columns[name])].rename(columns=self.columns[name])
+            for name, df in self.sources.items()
+        }
+        frames = self.align_categories(frames)
+        self.merge_report = self.count_dropped(frames)
+
+        combined = reduce(lambda left, right: pd.merge(left, right, on=self.keys, how='inner'), frames.values())
+        if column_order is not None:
+            combined = combined[column_order]
+        return combined.reset_index(drop=True)
+
+    def get_merge_report(self) -> Dict[str, Dict[str, int]]:
+        '''
+        rows read and rows dropped by the join for every source
+        '''
+        return self.merge_report
+
+
+
 class FinalDataColumns:
     
     def __init__(self, df1):
 
         self.df1 = df1
               
+    @instrument
     def select_columns(self, columns):
         '''
         select specific columns of interest from the merged data
@@ -69,26 +351,52 @@ class renamedCombinedData:
     def __init__(self, df2):
         self.df2 = df2
     
+    @instrument
     def rename_final_raw_data_columns(self, columns_mapping):
         """
         Rename columns in a dataframe
         """
-        # Vectorized operation to replace column names
-        new_columns = self.df2.columns.to_series().replace(columns_mapping)
-        
-        self.df2.columns = new_columns
+        # Renaming only replaces the column index, the data is shared
+        self.df2 = self.df2.rename(columns=columns_mapping)
         
         return self.df2
 
 
+def load_continent_table(path: str) -> Dict[str, str]:
+    '''
+    load the persisted country to continent table, empty when it does not exist yet
+    '''
+    if path is None or not os.path.exists(path):
+        return {}
+    table = pd.read_csv(path, keep_default_na=False)
+    return dict(zip(table['Country'], table['Continent']))
+
+
+def save_continent_table(mapping: Dict[str, str], path: str) -> None:
+    '''
+    persist the resolved country to continent table
+    '''
+    table = pd.DataFrame(sorted(mapping.items()), columns=['Country', 'Continent'])
+    # written aside and swapped in, the table can be shared by concurrent runs
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    table.to_csv(temporary, index=False)
+    os.replace(temporary, path)
+
+
 class TranformRawData:
     
-    def __init__(self, df: pd.DataFrame, column_name: str) -> None:
+    def __init__(self, df: pd.DataFrame, column_name: str, continent_file: str = None) -> None:
         self.df = df
         self.column_name = column_name
+        self.continent_file = continent_file
     
     def get_continent(self, country_name):
         
+        if country_name in CONTINENT_OVERRIDES:
+            return CONTINENT_OVERRIDES[country_name]
+        import pycountry
+        import pycountry_convert as pc
         try:
             # Get the ISO alpha-2 code of the country
             country_code = pycountry.countries.lookup(country_name).alpha_2
@@ -97,38 +405,70 @@ class TranformRawData:
             # Convert continent code to continent name
             continent_name = pc.convert_continent_code_to_continent_name(continent_code)
             return continent_name
-        except:
+        except (LookupError, KeyError):
             return None
+
+    def get_continent_mapping(self, countries) -> Dict[str, str]:
+        '''
+        resolve the continent of each distinct country once, reusing the
+        persisted table and updating it with newly resolved names
+        '''
+        table = load_continent_table(self.continent_file)
+        mapping = {}
+        for country in countries:
+            if country in CONTINENT_OVERRIDES:
+                mapping[country] = CONTINENT_OVERRIDES[country]
+            elif country in table:
+                mapping[country] = table[country]
+            else:
+                mapping[country] = self.get_continent(country)
+
+        unresolved = sorted(country for country, continent in mapping.items() if continent is None)
+        if unresolved:
+            warnings.warn(f"no continent found for countries: {unresolved}")
+
+        resolved = {country: continent for country, continent in mapping.items() if continent is not None}
+        if self.continent_file is not None and not resolved.items() <= table.items():
+            save_continent_table({**table, **resolved}, self.continent_file)
+        return mapping
         
-    def map_continent(self):
-     # Apply the get_continent function to map countries to continents
-        self.df = self.df.assign(Continent=self.df['Country'].apply(self.get_continent))
-        #print(self.df.head())
+    @instrument
+    def map_continent(self, mapping: Dict[str, str] = None):
+        # Resolve each distinct country once and broadcast the result back to the rows
+        codes, countries = pd.factorize(self.df['Country'])
+        mapping = self.get_continent_mapping(countries) if mapping is None else mapping
+        continents = np.array([mapping.get(country) for country in countries] + [None], dtype=object)
+        self.df = self.df.assign(Continent=continents[codes])      # code -1 (missing country) picks the trailing None
         return self.df
         
     
 
+    @instrument
     def replace_column_data(self) -> pd.DataFrame:
         """
         Replace '..' with '0' in the specified column and convert the column to integers.
+        Columns read with a numeric schema carry the '..' sentinel as NaN instead.
         """
         if self.column_name not in self.df.columns:
             raise ValueError(f"The column '{self.column_name}' is not in the DataFrame.")
         
-        self.df.loc[self.df[self.column_name] == '..', self.column_name] = '0'
+        column = self.df[self.column_name]
+        if column.dtype == object:
+            column = column.mask(column == '..', '0')
         
         
-        self.df.loc[:, self.column_name] = self.df[self.column_name].astype(int)     # Conversion
+        self.df = self.df.assign(**{self.column_name: column.fillna(0).astype(int)})     # Conversion
         
         return self.df
 
 
 class RfPredictionModel:
     
-    def __init__(self, data, features_column, target_column):
+    def __init__(self, data, features_column, target_column, params: Dict = None):
         self.data = data
         self.target_column = target_column
         self.features_column = features_column
+        self.params = {**DEFAULT_RF_PARAMS, **(params or {})}
         self.test_size = 0.3
         self.random_state = 0
         self.model = None
@@ -137,10 +477,48 @@ class RfPredictionModel:
         self.mse = None
         self.score = None
         self.feature_importance = None
+        self.oob_scores = []
+        self.best_params = None
+        self._features = None
+
+    def build_model(self, **overrides) -> 'RandomForestRegressor':
+        """
+        Build the forest from the configured hyperparameters.
+        """
+        from sklearn.ensemble import RandomForestRegressor
+
+        forest_params = {name: self.params[name] for name in FOREST_PARAMS}
+        forest_params.update(overrides)
+        return RandomForestRegressor(random_state=self.random_state, **forest_params)
+
+    def fit_model(self, X, y) -> 'RandomForestRegressor':
+        """
+        Fit the forest at once, or grow it warm_start_step trees at a time until
+        n_estimators is reached or the out-of-bag score stops improving.
+        """
+        step = self.params['warm_start_step']
+        if not step:
+            return self.build_model().fit(X, y)
 
+        n_estimators = self.params['n_estimators']
+        trees = min(step, n_estimators)
+        model = self.build_model(n_estimators=trees, warm_start=True, oob_score=True)
+        self.oob_scores = []
+        while True:
+            model.fit(X, y)
+            self.oob_scores.append(model.oob_score_)
+            converged = len(self.oob_scores) > 1 and self.oob_scores[-1] - self.oob_scores[-2] < self.params['oob_tolerance']
+            if trees >= n_estimators or converged:
+                return model
+            trees = min(trees + step, n_estimators)
+            model.set_params(n_estimators=trees)
+
+    @instrument
     def train_and_evaluate(self):
-        
-        X = self.data[self.features_column]    
+        from sklearn.metrics import mean_squared_error
+        from sklearn.model_selection import train_test_split
+
+        X = self.data[self.features_column].astype(np.float32)    
         y = self.data[self.target_column]
 
         # Split the dataset into training and testing sets
@@ -150,8 +528,7 @@ class RfPredictionModel:
         #print(f"Training and testing shapes: {self.X_train.shape}, {self.X_test.shape}, {self.y_train.shape}, {self.y_test.shape}")
 
         # Build and fit the RandomForestRegressor model
-        self.model = RandomForestRegressor(random_state=self.random_state)
-        self.model.fit(self.X_train, self.y_train)
+        self.model = self.fit_model(self.X_train, self.y_train)
 
         # Predict and evaluate the model on the test set
         self.y_pred = self.model.predict(self.X_test)
@@ -167,4 +544,277 @@ class RfPredictionModel:
             'y_test': self.y_test,
             'y_pred': self.y_pred,
             'feature_importance': self.feature_importance
-        }
\ No newline at end of file
+        }
+
+    def feature_matrix(self):
+        """
+        Float32 features, target and Country groups ordered by Year, built once and
+        reused by every fold and search candidate.
+        """
+        if self._features is None:
+            data = self.data.sort_values('Year', kind='stable') if 'Year' in self.data.columns else self.data
+            X = data[self.features_column].to_numpy(dtype=np.float32)
+            y = data[self.target_column].to_numpy(dtype=np.float64)
+            groups = data['Country'].to_numpy() if 'Country' in data.columns else None
+            self._features = (X, y, groups)
+        return self._features
+
+    def cv_splitter(self, cv_mode: str, n_splits: int):
+        """
+        Cross-validation splitter: 'kfold' shuffled folds, 'country' folds grouped by
+        Country, 'year' time-ordered folds that always validate on later years.
+        """
+        from sklearn.model_selection import GroupKFold, KFold, TimeSeriesSplit
+
+        if cv_mode == 'kfold':
+            return KFold(n_splits=n_splits, shuffle=True, random_state=self.random_state)
+        if cv_mode == 'country':
+            return GroupKFold(n_splits=n_splits)
+        if cv_mode == 'year':
+            return TimeSeriesSplit(n_splits=n_splits)
+        raise ValueError(f"unknown cv mode '{cv_mode}', expected 'kfold', 'country' or 'year'")
+
+    @instrument
+    def cross_validate(self, cv_mode: str = 'kfold', n_splits: int = 5, n_jobs: int = -1) -> pd.DataFrame:
+        """
+        Cross-validate the configured forest with the folds fanned out over n_jobs processes.
+
+        Returns:
+        a dataframe with fit/score time, r2 and mse per fold
+        """
+        from sklearn.model_selection import cross_validate
+
+        X, y, groups = self.feature_matrix()
+        # one tree builder per fold process to avoid oversubscribing the cores
+        results = cross_validate(self.build_model(n_jobs=1), X, y, groups=groups if cv_mode == 'country' else None,
+                                 cv=self.cv_splitter(cv_mode, n_splits), scoring=CV_SCORING, n_jobs=n_jobs)
+        folds = pd.DataFrame(results)
+        folds['test_mse'] = -folds['test_mse']
+        return folds
+
+    @instrument
+    def search_hyperparameters(self, param_distributions: Dict = None, n_iter: int = 20, method: str = 'random',
+                               cv_mode: str = 'kfold', n_splits: int = 5, n_jobs: int = -1,
+                               results_path: str = None) -> pd.DataFrame:
+        """
+        Randomized or successive-halving search over the forest hyperparameters,
+        candidates and folds run in parallel over n_jobs processes. The best
+        parameters are kept in best_params and merged into params.
+
+        Returns:
+        a dataframe with the parameters, fit/predict timings and scores per configuration
+        """
+        from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+        from sklearn.model_selection import HalvingRandomSearchCV, RandomizedSearchCV
+
+        X, y, groups = self.feature_matrix()
+        options = dict(cv=self.cv_splitter(cv_mode, n_splits), n_jobs=n_jobs, random_state=self.random_state)
+        distributions = param_distributions or RF_PARAM_DISTRIBUTIONS
+        if method == 'random':
+            search = RandomizedSearchCV(self.build_model(n_jobs=1), distributions, n_iter=n_iter,
+                                        scoring=CV_SCORING, refit='r2', **options)
+        elif method == 'halving':
+            search = HalvingRandomSearchCV(self.build_model(n_jobs=1), distributions, n_candidates=n_iter,
+                                           scoring='r2', **options)
+        else:
+            raise ValueError(f"unknown search method '{method}', expected 'random' or 'halving'")
+
+        search.fit(X, y, groups=groups if cv_mode == 'country' else None)
+        self.best_params = search.best_params_
+        self.params.update(self.best_params)
+
+        columns = [col for col in search.cv_results_ if col == 'params' or col.startswith(('mean_', 'std_', 'rank_'))
+                   or col in ('iter', 'n_resources')]
+        results = pd.DataFrame(search.cv_results_)[columns]
+        if 'mean_test_mse' in results.columns:
+            results['mean_test_mse'] = -results['mean_test_mse']
+        if results_path is not None:
+            results.to_csv(results_path, index=False)
+        return results
+
+    def model_key(self) -> str:
+        """
+        Hash of the training data, the columns and the hyperparameters, identifying a fitted model.
+        """
+        digest = hashlib.sha256()
+        digest.update(pd.util.hash_pandas_object(self.data[self.features_column + [self.target_column]], index=False).values.tobytes())
+        settings = [self.features_column, self.target_column, self.params, self.test_size, self.random_state]
+        digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def save(self, path: str) -> None:
+        """
+        Persist the fitted model with its feature schema and evaluation results.
+        """
+        state = {
+            'model': self.model,
+            'features_column': self.features_column,
+            'target_column': self.target_column,
+            'params': self.params,
+            'score': self.score,
+            'mse': self.mse,
+            'oob_scores': self.oob_scores,
+            'results': self.get_model_results(),
+        }
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        joblib.dump(state, temporary)
+        os.replace(temporary, path)
+
+    def load(self, path: str) -> None:
+        """
+        Restore a model saved with save, the forest arrays are memory-mapped.
+        """
+        state = joblib.load(path, mmap_mode='r')
+        self.model = state['model']
+        self.features_column = state['features_column']
+        self.target_column = state['target_column']
+        self.params = state['params']
+        self.score = state['score']
+        self.mse = state['mse']
+        self.oob_scores = state['oob_scores']
+        results = state['results']
+        self.X_train, self.X_test = results['X_train'], results['X_test']
+        self.y_train, self.y_test = results['y_train'], results['y_test']
+        self.y_pred = results['y_pred']
+        self.feature_importance = results['feature_importance']
+
+    @classmethod
+    def from_file(cls, path: str) -> 'RfPredictionModel':
+        """
+        Load a saved model for scoring without its training data.
+        """
+        rf_model = cls(None, [], None)
+        rf_model.load(path)
+        return rf_model
+
+    @instrument
+    def train_or_load(self, model_dir: str) -> str:
+        """
+        Load the model fitted on the same data and hyperparameters from model_dir,
+        training and saving it there first when it does not exist yet.
+        """
+        path = os.path.join(model_dir, f"rf-{self.model_key()[:16]}.joblib")
+        if os.path.exists(path):
+            self.load(path)
+        else:
+            self.train_and_evaluate()
+            self.save(path)
+        return path
+
+    @instrument
+    def predict_batch(self, data, chunksize: int = PREDICT_CHUNK_SIZE) -> pd.Series:
+        """
+        Score a DataFrame, or a csv path or buffer, holding the feature columns in chunks.
+        """
+        if self.model is None:
+            raise ValueError("the model is not trained or loaded")
+
+        if isinstance(data, pd.DataFrame):
+            missing = [col for col in self.features_column if col not in data.columns]
+            if missing:
+                raise ValueError(f"missing feature columns: {missing}")
+            chunks = (data.iloc[start:start + chunksize] for start in range(0, len(data), chunksize))
+        else:
+            chunks = pd.read_csv(data, usecols=self.features_column, chunksize=chunksize)
+
+        predictions = []
+        for chunk in chunks:
+            features = chunk[self.features_column].to_numpy(dtype=np.float32)
+            predictions.append(pd.Series(self.model.predict(features), index=chunk.index))
+
+        if not predictions:
+            return pd.Series([], dtype=np.float64, name=self.target_column)
+        return pd.concat(predictions).rename(self.target_column)
+
+
+
+def train_shard(shard_key, data, features_column, target_column, params):
+    '''
+    train the model of a single shard in a worker process and return it without its training data
+    '''
+    rf_model = RfPredictionModel(data, features_column, target_column, params)
+    rf_model.train_and_evaluate()
+    rf_model.data = None
+    rf_model._features = None
+    return shard_key, rf_model
+
+
+
+class ShardedRfPredictionModel:
+    
+    def __init__(self, data, features_column, target_column, shard_columns=('crop_types',),
+                 params: Dict = None, min_rows: int = MIN_SHARD_ROWS):
+        '''
+        one RfPredictionModel per value of the shard columns, e.g. ('crop_types',)
+        or ('crop_types', 'Continent'), routed by the shard key
+        '''
+        self.data = data
+        self.features_column = features_column
+        self.target_column = target_column
+        self.shard_columns = list(shard_columns)
+        self.params = params or {}
+        self.min_rows = min_rows
+        self.models = {}
+
+    def shard_groups(self, data: pd.DataFrame):
+        """
+        Group the rows by shard. A single shard column is grouped by name, so the shard
+        keys are its values (models['Maize']) rather than 1-tuples.
+        """
+        columns = self.shard_columns[0] if len(self.shard_columns) == 1 else self.shard_columns
+        return data.groupby(columns, observed=True)
+
+    @instrument
+    def train_and_evaluate(self, n_jobs: int = -1):
+        """
+        Train the shards in parallel worker processes, each forest single-threaded.
+        """
+        shards = []
+        skipped = []
+        for shard_key, shard in self.shard_groups(self.data):
+            if len(shard) < self.min_rows:
+                skipped.append(shard_key)
+            else:
+                shards.append((shard_key, shard))
+        if skipped:
+            warnings.warn(f"shards with fewer than {self.min_rows} rows are not trained: {skipped}")
+
+        params = {**self.params, 'n_jobs': 1}
+        trained = Parallel(n_jobs=n_jobs)(
+            delayed(train_shard)(shard_key, shard, self.features_column, self.target_column, params)
+            for shard_key, shard in shards)
+        self.models = dict(trained)
+
+    def get_metrics(self) -> pd.DataFrame:
+        """
+        Per shard rows, r2 and mse, with an 'overall' row over all the shard test sets.
+
+        Returns:
+        a dataframe indexed by shard key
+        """
+        from sklearn.metrics import mean_squared_error, r2_score
+
+        rows = {
+            shard_key: {'train_rows': len(rf_model.y_train), 'test_rows': len(rf_model.y_test),
+                        'score': rf_model.score, 'mse': rf_model.mse}
+            for shard_key, rf_model in self.models.items()
+        }
+        if self.models:
+            y_test = np.concatenate([np.asarray(rf_model.y_test) for rf_model in self.models.values()])
+            y_pred = np.concatenate([np.asarray(rf_model.y_pred) for rf_model in self.models.values()])
+            rows['overall'] = {'train_rows': sum(row['train_rows'] for row in rows.values()), 'test_rows': len(y_test),
+                               'score': r2_score(y_test, y_pred), 'mse': mean_squared_error(y_test, y_pred)}
+        return pd.DataFrame.from_dict(rows, orient='index')
+
+    @instrument
+    def predict(self, data: pd.DataFrame) -> pd.Series:
+        """
+        Route each row to the model of its shard, rows without a trained shard get NaN.
+        """
+        predictions = pd.Series(np.nan, index=data.index, name=self.target_column)
+        for shard_key, shard in self.shard_groups(data):
+            rf_model = self.models.get(shard_key)
+            if rf_model is not None:
+                predictions.loc[shard.index] = rf_model.predict_batch(shard).to_numpy()
+        return predictions
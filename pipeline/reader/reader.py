@@ -1,46 +1,211 @@
 import csv
+import glob
+import hashlib
+import importlib.util
+import io
+import os
+from itertools import islice
+from typing import Dict
 import pandas as pd
+from pandas.api.types import union_categoricals
+from pipeline.utils.instrumentation import instrument
 
-def read_csv_file(csv_path: str, delimiter: str) -> pd.DataFrame:
+RAIN_CHUNK_SIZE = 100_000
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def schema_options(schema: Dict[str, str] = None, engine: str = None) -> dict:
+    '''
+    build the pd.read_csv keyword arguments for a declared dataset schema
+    '''
+    options = {}
+    if schema is not None:
+        options['usecols'] = list(schema)
+        options['dtype'] = schema
+    if engine is not None:
+        options['engine'] = engine
+    return options
+
+
+@instrument
+def read_csv_file(csv_path: str, delimiter: str, schema: Dict[str, str] = None, engine: str = None) -> pd.DataFrame:
     '''
     read csv files for yield and pesticide
     '''
     
-    return pd.read_csv(csv_path, sep = delimiter)
+    return pd.read_csv(csv_path, sep = delimiter, **schema_options(schema, engine))
 
 
 
-def read_temp_file(csv_path: str, encoding) -> pd.DataFrame:
+@instrument
+def read_temp_file(csv_path: str, encoding, schema: Dict[str, str] = None, engine: str = None) -> pd.DataFrame:
     '''
     read csv file for temperature dataset
     '''
     
-    return pd.read_csv(csv_path, encoding=encoding)
+    return pd.read_csv(csv_path, encoding=encoding, **schema_options(schema, engine))
 
 
 
+def repair_rain_rows(lines):
+    '''
+    repair a chunk of raw rain lines where the country name contains commas
+
+    Returns:
+    a list of [country, year, rainfall] rows, malformed rows are dropped
+    '''
+    rows = []
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if '"' in line:
+            # quoted rows go through the csv module so the quoting is respected
+            row = next(csv.reader([line]), [])
+        else:
+            row = line.split(',')
+        # thie enable us join all columns with spaces and then split by the first two columns
+        # Assuming the format is consistent with three columns: country, year, rainfall
+        if len(row) < 3:
+            continue                  # Skip malformed rows
+        rows.append([' '.join(row[:-2]), row[-2], row[-1]])
+    return rows
+
+
+def concat_chunks(chunks) -> pd.DataFrame:
+    '''
+    concatenate frames parsed chunk by chunk, the categorical columns keep a
+    categorical dtype with the union of the chunk categories
+    '''
+    frame = pd.concat(chunks, ignore_index=True)
+    for column in frame.columns:
+        if all(isinstance(chunk[column].dtype, pd.CategoricalDtype) for chunk in chunks):
+            frame[column] = union_categoricals([chunk[column] for chunk in chunks])
+    return frame
+
+
+def repair_rain_chunk(lines) -> str:
+    '''
+    repair a chunk of raw rain lines, the well formed rows are kept as they are
+    and only the rows with extra columns or quotes go through repair_rain_rows
+
+    Returns:
+    the repaired rows as csv text
+    '''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    for line in lines:
+        if line.count(',') == 2 and '"' not in line:
+            buffer.write(line if line.endswith('\n') else line + '\n')
+        else:
+            writer.writerows(repair_rain_rows([line]))
+    return buffer.getvalue()
+
+
+@instrument
+def read_rain_data(csv_path: str, new_path: str = None, chunksize: int = RAIN_CHUNK_SIZE,
+                   schema: Dict[str, str] = None, na_values=None, engine: str = None) -> pd.DataFrame:
+    '''
+    read csv file for rain dataset which has additional columns for some rows
+
+    The rows are repaired and parsed chunk by chunk, so only one chunk of text
+    is held at a time, and appended to new_path when it is given.
+    '''
+    options = schema_options(schema, engine)
+    if na_values is not None:
+        options['na_values'] = na_values
+    outfile = open(new_path, 'w', newline='') if new_path is not None else None
+    chunks = []
+    try:
+        with open(csv_path, 'r') as infile:
+            header = repair_rain_rows(islice(infile, 1))
+            if not header:
+                return pd.DataFrame(columns=list(schema or []))
+            names = header[0]
+            buffer = io.StringIO()
+            csv.writer(buffer, lineterminator='\n').writerow(names)
+            header_line = buffer.getvalue()
+            if outfile is not None:
+                outfile.write(header_line)
+            while True:
+                lines = list(islice(infile, chunksize))
+                if not lines:
+                    break
+                text = repair_rain_chunk(lines)
+                if not text:
+                    continue
+                if outfile is not None:
+                    outfile.write(text)
+                # every chunk is parsed with the header line, so usecols selects by name
+                # with both engines, and the pyarrow engine only reads binary buffers
+                text = header_line + text
+                data = io.BytesIO(text.encode()) if engine == 'pyarrow' else io.StringIO(text)
+                chunks.append(pd.read_csv(data, **options))
+    finally:
+        if outfile is not None:
+            outfile.close()
+
+    if not chunks:
+        return pd.read_csv(io.StringIO(header_line), **options)
+    return concat_chunks(chunks)
+
+
+@instrument
 def read_rain_file(csv_path: str, new_path)-> pd.DataFrame:
     '''
     read csv file for rain dataset which has additional columns for some rows
+    and write the repaired rows to new_path
     '''
     
-    with open(csv_path, 'r') as infile, open(new_path, 'w', newline='') as outfile:
-        reader = csv.reader(infile)
-        writer = csv.writer(outfile)
-        for row in reader:
-            # thie enable us join all columns with spaces and then split by the first two columns
-            # Assuming the format is consistent with three columns: country, year, rainfall
-            if len(row) < 3:
-                continue                  # Skip malformed rows
-            country = ' '.join(row[:-2])
-            year = row[-2]
-            average_rain_fall_mm_per_year = row[-1]
-            writer.writerow([country, year, average_rain_fall_mm_per_year])
+    return read_rain_data(csv_path, new_path=new_path)
             
             
 
+@instrument
 def read_newrain_file(csv_path: str) -> pd.DataFrame:
     '''
     read csv file for the modified rain dataset
     '''
-    return pd.read_csv(csv_path)
\ No newline at end of file
+    return pd.read_csv(csv_path)
+
+
+
+def file_hash(path: str) -> str:
+    '''
+    compute the sha256 hash of a file content
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+
+@instrument
+def read_cached(read_function, csv_path: str, cache_dir: str = None, **kwargs) -> pd.DataFrame:
+    '''
+    read a dataset through a parquet cache keyed on the file content and
+    the reader arguments, so unchanged files skip csv parsing entirely
+
+    Falls back to read_function directly when no cache_dir is given or
+    pyarrow is not installed.
+    '''
+    if cache_dir is None or importlib.util.find_spec('pyarrow') is None:
+        return read_function(csv_path, **kwargs)
+
+    # one entry per reader and arguments, named after the file content it holds
+    reader_key = hashlib.sha256(f"{read_function.__name__}{sorted(kwargs.items())}".encode()).hexdigest()[:8]
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    prefix = f"{name}-{reader_key}-"
+    cache_path = os.path.join(cache_dir, f"{prefix}{file_hash(csv_path)[:16]}.parquet")
+
+    if os.path.exists(cache_path):
+        return pd.read_parquet(cache_path)
+
+    df = read_function(csv_path, **kwargs)
+    os.makedirs(cache_dir, exist_ok=True)
+    df.to_parquet(cache_path, index=False)
+    # the entries of older versions of the file are not read again
+    for entry in glob.glob(os.path.join(glob.escape(cache_dir), glob.escape(prefix) + '*.parquet')):
+        if entry != cache_path:
+            os.remove(entry)
+    return df
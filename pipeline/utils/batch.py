@@ -0,0 +1,148 @@
+import json
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Dict, List
+from pipeline.utils.constants import BATCH_BASE_MEMORY, BATCH_JOBS, INPUT_MEMORY_FACTOR, get_data_paths
+
+MEMORY_UNITS = {'': 1, 'B': 1, 'KB': 2**10, 'MB': 2**20, 'GB': 2**30, 'TB': 2**40}
+
+
+def parse_memory(size: str) -> int:
+    '''
+    parse a memory size such as '512MB' or '8GB' into bytes
+    '''
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMGT]?B?)\s*', str(size).upper())
+    if match is None:
+        raise ValueError(f"invalid memory size '{size}', expected e.g. 512MB or 8GB")
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2)])
+
+
+def read_manifest(path: str) -> List[Dict[str, str]]:
+    '''
+    read the datasets of a manifest, either a json list of data directories or of
+    {"data_dir": ..., "name": ...} objects, or a text file with one data directory
+    per line. Relative directories are taken from the manifest location
+    '''
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path) as infile:
+        text = infile.read()
+    if path.endswith('.json'):
+        entries = json.loads(text)
+    else:
+        entries = [line.strip() for line in text.splitlines() if line.strip() and not line.strip().startswith('#')]
+
+    datasets = []
+    for entry in entries:
+        entry = {'data_dir': entry} if isinstance(entry, str) else dict(entry)
+        entry['data_dir'] = os.path.join(base, os.path.expanduser(entry['data_dir']))
+        datasets.append(entry)
+    return datasets
+
+
+def dataset_jobs(datasets: List[Dict[str, str]], output_dir: str = None) -> List[Dict[str, str]]:
+    '''
+    name every dataset after its directory, unique across the batch, and give it
+    its own output folder under output_dir (default: <data-dir>/output)
+    '''
+    jobs = []
+    names = set()
+    for dataset in datasets:
+        name = dataset.get('name') or os.path.basename(os.path.normpath(dataset['data_dir']))
+        unique, suffix = name, 2
+        while unique in names:
+            unique, suffix = f"{name}-{suffix}", suffix + 1
+        names.add(unique)
+        jobs.append({
+            'name': unique,
+            'data_dir': dataset['data_dir'],
+            'output_dir': os.path.join(output_dir, unique) if output_dir else None,
+        })
+    return jobs
+
+
+def default_shared_dir(datasets: List[Dict[str, str]], output_dir: str = None) -> str:
+    '''
+    folder of the continent table and model cache of a batch: <output_dir>/shared,
+    or shared/ in the common parent of the data directories without output_dir
+    '''
+    if output_dir is None:
+        output_dir = os.path.commonpath([os.path.abspath(dataset['data_dir']) for dataset in datasets])
+        if len(datasets) == 1:
+            output_dir = os.path.dirname(output_dir)
+    return os.path.join(output_dir, 'shared')
+
+
+def estimate_memory(job: Dict[str, str]) -> int:
+    '''
+    peak rss of the previous run of the dataset when its run report exists,
+    otherwise a guess from the size of the input files
+    '''
+    paths = get_data_paths(job['data_dir'], job['output_dir'])
+    report = os.path.join(paths['figures'], 'run_report.json')
+    if os.path.exists(report):
+        with open(report) as infile:
+            report = json.load(infile)
+        # the stage totals also cover the calls dropped from the records
+        records = report['records'] + list(report.get('stages', {}).values())
+        peaks = [record.get('peak_rss_bytes') or 0 for record in records]
+        if peaks and max(peaks):
+            return max(peaks)
+    inputs = [paths[name] for name in ['rain', 'temperature', 'pesticide', 'yield']]
+    return BATCH_BASE_MEMORY + INPUT_MEMORY_FACTOR * sum(os.path.getsize(path) for path in inputs if os.path.exists(path))
+
+
+class BatchRunner:
+    '''
+    runs the pipeline of several datasets, each in a single-worker process pool
+    of its own, at most `jobs` at once and, past the first one, only while the
+    estimated memory of the running datasets stays within memory_budget. Every
+    dataset runs in a fresh process so its memory and run report are released
+    when it finishes. There is no shared multiprocessing.Pool: its workers are
+    daemonic and could not start the figure export processes of the dataset
+    '''
+    def __init__(self, run: Callable, jobs: int = BATCH_JOBS, memory_budget: int = None) -> None:
+        self.run_job = run
+        self.jobs = max(1, jobs)
+        self.memory_budget = memory_budget
+
+    def fits(self, job, running) -> bool:
+        if not running or self.memory_budget is None:
+            return True
+        return sum(other['memory'] for other in running.values()) + job['memory'] <= self.memory_budget
+
+    def run(self, jobs: List[Dict]) -> Dict[str, str]:
+        """
+        Run the jobs, a failing dataset does not stop the others.
+
+        Returns:
+        'ok' or the error of every dataset, by name
+        """
+        pending = [{**job, 'memory': estimate_memory(job)} for job in jobs]
+        running = {}
+        results = {}
+        try:
+            while pending or running:
+                for job in list(pending):
+                    if len(running) >= self.jobs:
+                        break
+                    if self.fits(job, running):
+                        pending.remove(job)
+                        print(f"Starting {job['name']} ({job['memory'] / 2**20:.0f} MB estimated)")
+                        # a pool per dataset gives every dataset a fresh, non-daemonic process
+                        pool = ProcessPoolExecutor(max_workers=1)
+                        running[pool.submit(self.run_job, job)] = {**job, 'pool': pool}
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    job['pool'].shutdown()
+                    try:
+                        future.result()
+                        results[job['name']] = 'ok'
+                    except Exception as error:
+                        results[job['name']] = f"failed: {type(error).__name__}: {error}"
+                    print(f"Finished {job['name']}: {results[job['name']]}")
+        finally:
+            for job in running.values():
+                job['pool'].shutdown(cancel_futures=True)
+        return results
@@ -1,6 +1,4 @@
 import os
-import pandas as pd
-from pathlib import Path
 
 def get_data_directory_path():
     """
@@ -16,12 +14,84 @@ def get_data_directory_path():
         return os.path.dirname(os.path.dirname(__file__))  # Default to the local directory structure
      
 
+def get_data_paths(data_dir, output_dir=None, shared_dir=None):
+    """
+    Get the input, cache and output paths for a data directory, the continent
+    table and the model cache go to shared_dir when several datasets share them.
+    """
+    store_dir = os.path.join(data_dir, "data", "store")
+    return {
+        'rain': os.path.join(data_dir, "data", "rain.csv"),
+        'new_rain': os.path.join(data_dir, "data", "modified_rain.csv"),
+        'temperature': os.path.join(data_dir, "data", "temperature.csv"),
+        'pesticide': os.path.join(data_dir, "data", "pesticides_usage.csv"),
+        'yield': os.path.join(data_dir, "data", "yield.csv"),
+        'figures': os.path.join(output_dir or os.path.join(data_dir, "output"), ""),
+        'cache': os.path.join(data_dir, "data", "cache"),
+        'continents': os.path.join(shared_dir or os.path.join(data_dir, "data"), "continents.csv"),
+        'models': os.path.join(shared_dir or data_dir, "models"),
+        'store': store_dir,
+        'aggregates': os.path.join(store_dir, "aggregates"),
+        'checkpoints': os.path.join(data_dir, "data", "checkpoints"),
+    }
+
+
 DATA_DIR = get_data_directory_path()
+DATA_PATHS = get_data_paths(DATA_DIR)
+
+PATH_RAIN_FILE = DATA_PATHS['rain']
+NEW_RAIN_FILE = DATA_PATHS['new_rain']
+PATH_TEMPERATURE_FILE = DATA_PATHS['temperature']
+PATH_PESTICIDE_FILE = DATA_PATHS['pesticide']
+PATH_YIELD_FILE  = DATA_PATHS['yield']
+FIGURE_PATH = DATA_PATHS['figures']
+
+CACHE_DIR = DATA_PATHS['cache']
+
+
+# declared schemas for the input datasets, only these columns are read
+RAIN_SCHEMA = {'country': 'category', 'year': 'int16', 'average_rain_fall_mm_per_year': 'float32'}
+TEMPERATURE_SCHEMA = {'Country': 'category', 'Year': 'int16', 'avg_temp (°C)': 'float32'}
+PESTICIDE_SCHEMA = {'Country': 'category', 'Year': 'int16', 'Value': 'float32'}
+YIELD_SCHEMA = {'Country': 'category', 'Year': 'int16', 'Item': 'category', 'Value': 'float32'}
+NA_VALUES = ['..']                    # missing value sentinel used in the rain dataset
+CONTINENT_FILE = DATA_PATHS['continents']
 
-PATH_RAIN_FILE = os.path.join(DATA_DIR, "data", "rain.csv")
-NEW_RAIN_FILE = os.path.join(DATA_DIR, "data", "modified_rain.csv")
-PATH_TEMPERATURE_FILE = os.path.join(DATA_DIR, "data", "temperature.csv")
-PATH_PESTICIDE_FILE = os.path.join(DATA_DIR, "data", "pesticides_usage.csv")
-PATH_YIELD_FILE  = os.path.join(DATA_DIR, "data", "yield.csv")
-FIGURE_PATH = os.path.join(DATA_DIR, "output/")
 
+# manual continent overrides for country names pycountry cannot resolve
+CONTINENT_OVERRIDES = {
+    'Bahamas': 'North America',
+    'Bahamas  The': 'North America',
+    'Bolivia (Plurinational State of)': 'South America',
+    'Cape Verde': 'Africa',
+    'Democratic Republic of the Congo': 'Africa',
+    'Iran (Islamic Republic of)': 'Asia',
+    'Kosovo': 'Europe',
+    'Micronesia (Federated States of)': 'Oceania',
+    'Republic of Korea': 'Asia',
+    'Russia': 'Europe',
+    'Sudan (former)': 'Africa',
+    'Swaziland': 'Africa',
+    'The former Yugoslav Republic of Macedonia': 'Europe',
+    'Timor-Leste': 'Asia',
+    'Turkey': 'Asia',
+    'Venezuela (Bolivarian Republic of)': 'South America',
+}
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', os.cpu_count() or 1))      # processes used to export figures
+FIGURE_FORMATS = os.environ.get('FIGURE_FORMATS', 'html').split(',')     # html bundle and/or png files
+SCATTER_WEBGL_ROWS = 5_000            # scatters with more points are drawn with webgl (scattergl)
+SCATTER_MAX_ROWS = 50_000             # scatters with more points are downsampled
+STATISTICS_KEYS = ('Country', 'Year')     # partitions of the descriptive statistics
+DIGEST_COMPRESSION = 1000             # quantile digest of a column keeps at most this many centroids
+MODEL_DIR = DATA_PATHS['models']
+STORE_DIR = DATA_PATHS['store']
+INCREMENTAL = os.environ.get('INCREMENTAL', '0') == '1'     # only reprocess the keys changed since the last run
+AGGREGATE_DIR = DATA_PATHS['aggregates']
+CHECKPOINT_DIR = DATA_PATHS['checkpoints']
+CLEANING_RULES_FILE = os.path.join(os.path.dirname(__file__), "cleaning_rules.json")
+DUCKDB_MEMORY_LIMIT = os.environ.get('DUCKDB_MEMORY_LIMIT', '2GB')     # memory duckdb uses before spilling to disk
+RUN_REPORT_RECORDS = int(os.environ.get('RUN_REPORT_RECORDS', '100000'))     # calls kept in the run report, totals cover all
+SAMPLE_ROWS = 500_000                 # rows pulled into pandas for the row-level plots and the model
+BATCH_JOBS = int(os.environ.get('BATCH_JOBS', '2'))     # datasets processed at once by the batch runner
+BATCH_BASE_MEMORY = 400 * 2**20       # rss of a pipeline process before it loads any data
+INPUT_MEMORY_FACTOR = 8               # peak rss per byte of input csv, when no previous run report exists
@@ -0,0 +1,186 @@
+import functools
+import glob
+import hashlib
+import inspect
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List
+import joblib
+import pandas as pd
+from pipeline.reader.reader import file_hash
+from pipeline.utils.memory import measure_memory
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHECKPOINT_NAME = re.compile(r'-[0-9a-f]{16}\.(parquet|joblib)$')
+
+
+@functools.lru_cache(maxsize=None)
+def source_fingerprint(directory: str = PACKAGE_DIR) -> str:
+    '''
+    hash of the python sources and data files (cleaning rules) of a package, so
+    that a change to the processing code or its constants invalidates the checkpoints
+    '''
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if d != '__pycache__')
+        for filename in sorted(files):
+            if filename.endswith(('.py', '.json')):
+                path = os.path.join(root, filename)
+                digest.update(os.path.relpath(path, directory).encode())
+                digest.update(file_hash(path).encode())
+    return digest.hexdigest()
+
+
+class Stage:
+    
+    def __init__(self, name: str, func: Callable, deps: List[str], checkpoint: str = None,
+                 inputs: List[str] = None, params: Dict = None) -> None:
+        '''
+        a pipeline stage, func is called with the results of deps in order.
+        checkpoint is 'frame' (parquet), 'object' (joblib) or None for stages
+        that always run, inputs are files whose content feeds the stage key
+        '''
+        if checkpoint not in (None, 'frame', 'object'):
+            raise ValueError(f"unknown checkpoint type '{checkpoint}' for stage '{name}'")
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.checkpoint = checkpoint
+        self.inputs = list(inputs or [])
+        self.params = params or {}
+
+
+
+class StageGraph:
+    
+    def __init__(self, checkpoint_dir: str, workers: int = 4) -> None:
+        self.checkpoint_dir = checkpoint_dir
+        self.workers = workers
+        self.stages = {}
+        self.keys = {}
+        self.memory_report = {}
+
+    def add(self, name: str, func: Callable, deps: Iterable[str] = (), checkpoint: str = None,
+            inputs: List[str] = None, params: Dict = None) -> None:
+        """
+        Add a stage, its dependencies must already be in the graph.
+        """
+        missing = [dep for dep in deps if dep not in self.stages]
+        if missing:
+            raise ValueError(f"stage '{name}' depends on unknown stages {missing}")
+        self.stages[name] = Stage(name, func, deps, checkpoint, inputs, params)
+
+    def stage_key(self, name: str) -> str:
+        """
+        Content address of a stage: the module defining it, the pipeline package
+        sources, its params, input files and the keys of its dependencies.
+        """
+        if name not in self.keys:
+            stage = self.stages[name]
+            digest = hashlib.sha256(name.encode())
+            try:
+                digest.update(file_hash(inspect.getsourcefile(stage.func)).encode())
+            except (OSError, TypeError):
+                digest.update(stage.func.__qualname__.encode())
+            digest.update(stage.func.__qualname__.encode())
+            digest.update(source_fingerprint().encode())
+            digest.update(repr(sorted(stage.params.items())).encode())
+            for path in stage.inputs:
+                # an input that does not exist yet still gives a key
+                digest.update(file_hash(path).encode() if os.path.exists(path) else b'missing')
+            for dep in stage.deps:
+                digest.update(self.stage_key(dep).encode())
+            self.keys[name] = digest.hexdigest()
+        return self.keys[name]
+
+    def checkpoint_path(self, name: str) -> str:
+        stage = self.stages[name]
+        extension = 'parquet' if stage.checkpoint == 'frame' else 'joblib'
+        return os.path.join(self.checkpoint_dir, f"{name}-{self.stage_key(name)[:16]}.{extension}")
+
+    def has_checkpoint(self, name: str) -> bool:
+        return self.stages[name].checkpoint is not None and os.path.exists(self.checkpoint_path(name))
+
+    def load_checkpoint(self, name: str):
+        if self.stages[name].checkpoint == 'frame':
+            return pd.read_parquet(self.checkpoint_path(name))
+        return joblib.load(self.checkpoint_path(name))
+
+    def save_checkpoint(self, name: str, result) -> None:
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        path = self.checkpoint_path(name)
+        if self.stages[name].checkpoint == 'frame':
+            result.to_parquet(path, index=False)
+        else:
+            joblib.dump(result, path)
+        self.prune_checkpoints(name)
+
+    def prune_checkpoints(self, name: str) -> None:
+        """
+        Remove the checkpoints of the stage saved under older keys.
+        """
+        current = self.checkpoint_path(name)
+        for path in glob.glob(os.path.join(glob.escape(self.checkpoint_dir), glob.escape(name) + '-*')):
+            suffix = os.path.basename(path)[len(name):]
+            if path != current and CHECKPOINT_NAME.fullmatch(suffix):
+                os.remove(path)
+
+    def plan(self, targets: Iterable[str], rerun: Iterable[str] = ()) -> Dict[str, str]:
+        """
+        Decide for every stage the targets need whether it is 'run' or 'load'ed
+        from its checkpoint. The dependencies of a loaded stage are not needed.
+        """
+        actions = {}
+
+        def visit(name):
+            if name in actions:
+                return
+            if name not in self.stages:
+                raise ValueError(f"unknown stage '{name}'")
+            if name not in rerun and self.has_checkpoint(name):
+                actions[name] = 'load'
+                return
+            actions[name] = 'run'
+            for dep in self.stages[name].deps:
+                visit(dep)
+
+        for target in targets:
+            visit(target)
+        return actions
+
+    def execute(self, name: str, results: Dict):
+        stage = self.stages[name]
+        with measure_memory(name, self.memory_report):
+            result = stage.func(*[results[dep] for dep in stage.deps])
+        if stage.checkpoint is not None:
+            self.save_checkpoint(name, result)
+        return result
+
+    def run(self, targets: Iterable[str] = None, rerun: Iterable[str] = ()) -> Dict:
+        """
+        Run the stages needed for targets (the final stages by default), skipping the ones
+        with a checkpoint for the same key unless named in rerun. Stages whose
+        dependencies are done run concurrently on a thread pool.
+
+        Returns:
+        the result of every stage that was run or loaded
+        """
+        if not targets:
+            needed = {dep for stage in self.stages.values() for dep in stage.deps}
+            targets = [name for name in self.stages if name not in needed]
+        rerun = set(rerun)
+        actions = self.plan(targets, rerun)
+        results = {name: self.load_checkpoint(name) for name, action in actions.items() if action == 'load'}
+        pending = [name for name in self.stages if actions.get(name) == 'run']
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            running = {}
+            while pending or running:
+                for name in [name for name in pending if all(dep in results for dep in self.stages[name].deps)]:
+                    pending.remove(name)
+                    running[pool.submit(self.execute, name, results)] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        return results
@@ -0,0 +1,179 @@
+import cProfile
+import functools
+import importlib.util
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+import pandas as pd
+from pipeline.utils.constants import RUN_REPORT_RECORDS
+from pipeline.utils.memory import track_memory
+
+logger = logging.getLogger('pipeline')
+
+ROW_ATTRIBUTES = ['df', 'data', 'df1', 'df2']      # attributes holding the frame of the processing classes
+
+
+class RunReport:
+    '''
+    collects one record per instrumented call: wall and cpu time, rows in and
+    out and the rss at start, end and peak of the call. Only the last
+    max_records records are kept, the totals per stage cover every call
+    '''
+    def __init__(self, max_records: int = RUN_REPORT_RECORDS) -> None:
+        self.records = deque(maxlen=max_records)
+        self.totals = {}
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def add(self, record: dict) -> None:
+        with self._lock:
+            if len(self.records) == self.records.maxlen:
+                self.dropped += 1
+            self.records.append(record)
+            total = self.totals.setdefault(record['stage'], {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+                                                             'rows_out': 0, 'peak_rss_bytes': 0})
+            total['calls'] += 1
+            total['wall_seconds'] += record['wall_seconds']
+            total['cpu_seconds'] += record['cpu_seconds']
+            total['rows_out'] += record['rows_out'] or 0
+            total['peak_rss_bytes'] = max(total['peak_rss_bytes'], record['peak_rss_bytes'])
+        logger.info(json.dumps(record, default=str))
+
+    def clear(self) -> None:
+        with self._lock:
+            self.records.clear()
+            self.totals = {}
+            self.dropped = 0
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(list(self.records))
+
+    def write_json(self, path: str) -> None:
+        """
+        Write the run report as a json document.
+        """
+        with self._lock:
+            report = {'records': list(self.records), 'dropped_records': self.dropped, 'stages': self.totals}
+            text = json.dumps(report, indent=2, default=str)
+        with open(path, 'w') as outfile:
+            outfile.write(text)
+
+    def write_openmetrics(self, path: str) -> None:
+        """
+        Write the totals per stage as an OpenMetrics textfile, e.g. for the node_exporter textfile collector.
+        """
+        with self._lock:
+            totals = {stage: dict(total) for stage, total in self.totals.items()}
+        lines = []
+        for metric, kind in [('calls', 'counter'), ('wall_seconds', 'counter'), ('cpu_seconds', 'counter'),
+                             ('rows_out', 'counter'), ('peak_rss_bytes', 'gauge')]:
+            name = f"pipeline_stage_{metric}"
+            # the samples of a counter family carry the _total suffix
+            sample = f"{name}_total" if kind == 'counter' else name
+            lines.append(f"# TYPE {name} {kind}")
+            for stage, total in totals.items():
+                lines.append(f'{sample}{{stage="{stage}"}} {total[metric]}')
+        lines.append("# EOF")
+        with open(path, 'w') as outfile:
+            outfile.write('\n'.join(lines) + '\n')
+
+
+RUN_REPORT = RunReport()
+
+
+def count_rows(value):
+    """
+    Rows of a DataFrame or Series, None for anything else.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    return None
+
+
+def input_rows(args):
+    """
+    Rows of the first frame among the arguments, or held by the processing class the method belongs to.
+    """
+    for arg in args:
+        if count_rows(arg) is not None:
+            return count_rows(arg)
+    if args:
+        for attribute in ROW_ATTRIBUTES:
+            rows = count_rows(getattr(args[0], attribute, None))
+            if rows is not None:
+                return rows
+    return None
+
+
+@contextmanager
+def instrumented(stage: str, rows_in: int = None, report: RunReport = RUN_REPORT):
+    """
+    Record a block into the run report, the yielded dict takes rows_out.
+    """
+    record = {'stage': stage, 'rows_in': rows_in, 'rows_out': None}
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        with track_memory() as usage:
+            yield record
+    finally:
+        record['wall_seconds'] = round(time.perf_counter() - wall, 6)
+        record['cpu_seconds'] = round(time.process_time() - cpu, 6)
+        record.update(usage)
+        report.add(record)
+
+
+def instrument(func):
+    """
+    Decorator recording every call of a reader, processor or writer function into RUN_REPORT.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with instrumented(func.__qualname__, input_rows(args)) as record:
+            result = func(*args, **kwargs)
+            record['rows_out'] = count_rows(result)
+        return result
+    return wrapper
+
+
+def configure_logging(level: str = os.environ.get('PIPELINE_LOG_LEVEL', 'INFO'), path: str = None) -> None:
+    """
+    Emit the json records of the pipeline logger to stderr, or to path when given.
+    """
+    handler = logging.FileHandler(path) if path else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.handlers = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+@contextmanager
+def profile_run(path: str = None, profiler: str = 'cprofile'):
+    """
+    Profile the block with cProfile, or pyinstrument when asked and installed, and dump it to path.
+    Does nothing when path is None.
+    """
+    if path is None:
+        yield
+        return
+    if profiler == 'pyinstrument' and importlib.util.find_spec('pyinstrument') is not None:
+        from pyinstrument import Profiler
+        session = Profiler()
+        session.start()
+        try:
+            yield
+        finally:
+            session.stop()
+            with open(path, 'w') as outfile:
+                outfile.write(session.output_html())
+        return
+    session = cProfile.Profile()
+    session.enable()
+    try:
+        yield
+    finally:
+        session.disable()
+        session.dump_stats(path)
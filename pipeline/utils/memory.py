@@ -0,0 +1,107 @@
+import os
+import resource
+import sys
+import threading
+from contextlib import contextmanager
+
+SAMPLE_INTERVAL = 0.01                # seconds between two rss samples
+
+
+def current_rss() -> int:
+    """
+    Resident set size of the process in bytes.
+    """
+    try:
+        with open('/proc/self/statm') as infile:
+            return int(infile.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # no procfs, fall back to the peak rss of the process
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+
+class PeakMemorySampler:
+    '''
+    samples the process rss on one background thread while any block is tracked
+    and raises the peak of every tracked block, so nested blocks (a stage and the
+    instrumented functions it calls) share a single sampler
+    '''
+    def __init__(self, interval: float = SAMPLE_INTERVAL) -> None:
+        self.interval = interval
+        self.blocks = []
+        self._lock = threading.Lock()
+        self._stop = None
+
+    def _sample(self, stop: threading.Event):
+        while not stop.wait(self.interval):
+            rss = current_rss()
+            with self._lock:
+                for usage in self.blocks:
+                    usage['peak_rss_bytes'] = max(usage['peak_rss_bytes'], rss)
+
+    def add(self, usage: dict) -> None:
+        with self._lock:
+            self.blocks.append(usage)
+            if self._stop is None:
+                self._stop = threading.Event()
+                threading.Thread(target=self._sample, args=(self._stop,), daemon=True).start()
+
+    def remove(self, usage: dict) -> None:
+        with self._lock:
+            self.blocks = [block for block in self.blocks if block is not usage]
+            if not self.blocks and self._stop is not None:
+                self._stop.set()
+                self._stop = None
+
+    def reset(self) -> None:
+        # a forked child does not inherit the sampling thread
+        self._lock = threading.Lock()
+        self.blocks = []
+        self._stop = None
+
+
+SAMPLER = PeakMemorySampler()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=SAMPLER.reset)
+
+
+@contextmanager
+def track_memory():
+    """
+    Yield a dict that receives the rss at the start and end of the block and its peak, in bytes.
+    """
+    rss = current_rss()
+    usage = {'rss_start_bytes': rss, 'peak_rss_bytes': rss}
+    SAMPLER.add(usage)
+    try:
+        yield usage
+    finally:
+        SAMPLER.remove(usage)
+        usage['rss_end_bytes'] = current_rss()
+        usage['peak_rss_bytes'] = max(usage['peak_rss_bytes'], usage['rss_end_bytes'])
+
+
+@contextmanager
+def measure_memory(name: str, report: dict):
+    """
+    Record the rss at the start and end of the block and its peak under report[name], in MB.
+    Blocks running concurrently share the process rss, so their peaks overlap.
+    """
+    with track_memory() as usage:
+        yield
+    report[name] = {
+        'rss_start_mb': round(usage['rss_start_bytes'] / 2**20, 1),
+        'rss_end_mb': round(usage['rss_end_bytes'] / 2**20, 1),
+        'peak_rss_mb': round(usage['peak_rss_bytes'] / 2**20, 1),
+    }
+
+
+def format_memory_report(report: dict) -> str:
+    """
+    One line per stage with its start, end and peak rss.
+    """
+    lines = [f"{'stage':<20}{'start MB':>10}{'end MB':>10}{'peak MB':>10}"]
+    for name, usage in report.items():
+        lines.append(f"{name:<20}{usage['rss_start_mb']:>10}{usage['rss_end_mb']:>10}{usage['peak_rss_mb']:>10}")
+    return '\n'.join(lines)
@@ -1,73 +1,448 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict
+import numpy as np
 import pandas as pd
-import plotly.express as px
 from pipeline.utils.constants import *
+from pipeline.utils.instrumentation import instrument
+
+
+class FigureRenderer:
+    '''
+    collects figures from the report classes and exports them together, as one
+    html page sharing a single plotly.js and/or as png files spread over a
+    process pool with one kaleido session per batch
+    '''
+    def __init__(self, workers: int = RENDER_WORKERS, formats=FIGURE_FORMATS, html_path: str = None,
+                 title: str = 'Report') -> None:
+        self.workers = max(1, workers)
+        self.formats = list(formats)
+        self.html_path = html_path
+        self.title = title
+        self.jobs = {}
+
+    def add(self, fig, path):
+        """
+        Queue a figure for export, a later figure for the same path replaces the earlier one.
+        """
+        self.jobs[path] = fig
+
+    @instrument
+    def render(self):
+        """
+        Export all queued figures and return the paths written.
+        """
+        figures = self.jobs
+        self.jobs = {}
+        written = []
+        if 'html' in self.formats and figures:
+            html_path = self.html_path or os.path.join(os.path.dirname(next(iter(figures))), 'report.html')
+            written.append(write_html_report(figures, html_path, self.title))
+        if 'png' in self.formats:
+            written += self.render_png(figures)
+        return written
+
+    def render_png(self, figures):
+        """
+        Export the figures as png files over the process pool.
+        """
+        jobs = [(fig.to_json(), path) for path, fig in figures.items()]
+        workers = min(self.workers, len(jobs))
+        if workers <= 1:
+            render_batch(jobs)
+        else:
+            batches = [jobs[i::workers] for i in range(workers)]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(render_batch, batches))
+        return [path for _, path in jobs]
+
+
+YIELD = 'yield_value (hg/ha)'
+PEST = 'pest_value (tonnes)'
+RAIN = 'average_rain_fall (mm/year)'
+TEMP = 'avg_temp (°C)'
+
+# every (keys, column, agg) combination the report plots are served from
+REPORT_AGGREGATIONS = [
+    (('Year', 'crop_types'), YIELD, 'mean'),
+    (('crop_types',), YIELD, 'mean'),
+    (('crop_types',), PEST, 'mean'),
+    (('crop_types',), RAIN, 'mean'),
+    (('Year',), RAIN, 'mean'),
+    (('Year',), PEST, 'mean'),
+    (('Year',), YIELD, 'mean'),
+]
+
+
+class AggregationCache:
+    '''
+    plans the groupby aggregations needed by the report and computes them
+    with one groupby per key set, cached per version of the dataset.
+    partitioned keeps the partition statistics an incremental run restores and
+    updates, otherwise describe and correlations are computed from the rows
+    '''
+    def __init__(self, data, plan=None, partitioned: bool = False) -> None:
+        self.data = data
+        self.plan = {}
+        self.results = {}
+        self.version = 0
+        self.statistics = PartitionStatistics() if partitioned else None
+        self.statistics_version = None
+        for keys, column, agg in plan or []:
+            self.register(keys, column, agg)
+
+    def register(self, keys, column, agg):
+        """
+        Add a (keys, column, agg) combination to the plan.
+        """
+        aggs = self.plan.setdefault(tuple(keys), {}).setdefault(column, [])
+        if agg not in aggs:
+            aggs.append(agg)
+
+    def set_data(self, data):
+        """
+        Swap the dataset, the cached aggregates of the previous version are dropped.
+        """
+        self.data = data
+        self.version += 1
+        self.results = {}
+        self.statistics_version = None
+
+    def dataset_version(self) -> int:
+        """
+        Version of the dataset, bumped by set_data. The cache lives as long as one
+        report, so counting the swaps is enough and the rows are never hashed.
+        """
+        return self.version
+
+    @instrument
+    def compute(self, keys) -> pd.DataFrame:
+        """
+        Run all planned aggregations for a key set in a single groupby.
+        """
+        result = self.data.groupby(list(keys), observed=True).agg(self.plan[keys])
+        self.results[(self.dataset_version(), keys)] = result
+        return result
+
+    def get(self, keys, columns: Dict[str, str]) -> pd.DataFrame:
+        """
+        Return the {column: agg} aggregates for the keys with the keys as columns,
+        computing the key set only when it is not cached for this dataset version.
+        """
+        keys = tuple(keys)
+        result = self.results.get((self.dataset_version(), keys))
+        if result is None or any((column, agg) not in result.columns for column, agg in columns.items()):
+            for column, agg in columns.items():
+                self.register(keys, column, agg)
+            result = self.compute(keys)
+
+        selected = result[[(column, agg) for column, agg in columns.items()]]
+        selected.columns = list(columns)
+        return selected.reset_index()
+
+    def partition_statistics(self) -> 'PartitionStatistics':
+        """
+        Partition statistics of the dataset, computed once per dataset version.
+        """
+        if self.statistics_version != self.dataset_version():
+            self.statistics.compute(self.data)
+            self.statistics_version = self.dataset_version()
+        return self.statistics
+
+    def describe(self) -> pd.DataFrame:
+        """
+        Descriptive statistics of the numeric columns of the dataset.
+        """
+        if self.statistics is None:
+            return self.data.describe()
+        return self.partition_statistics().describe()
+
+    def correlations(self, columns) -> pd.DataFrame:
+        """
+        Correlation matrix of the per country means of the columns.
+        """
+        if self.statistics is None:
+            return self.get(['Country'], {column: 'mean' for column in columns})[list(columns)].corr()
+        return self.partition_statistics().correlations(columns)
+
+    def save(self, directory: str) -> None:
+        """
+        Persist the aggregates computed for the current dataset, one parquet file per key set.
+        """
+        os.makedirs(directory, exist_ok=True)
+        version = self.dataset_version()
+        for (result_version, keys), result in self.results.items():
+            if result_version != version:
+                continue
+            frame = result.copy()
+            frame.columns = [f"{column}|{agg}" for column, agg in frame.columns]
+            frame.reset_index().to_parquet(os.path.join(directory, '-'.join(keys) + '.parquet'), index=False)
+        if self.statistics is not None and self.statistics_version == version:
+            self.statistics.save(directory)
+
+    def restore(self, directory: str, added: pd.DataFrame, removed: pd.DataFrame) -> None:
+        """
+        Load the aggregates saved for the previous dataset and recompute only the
+        groups an incremental run changed. added and removed are the merged rows the
+        run wrote and replaced, the touched groups are read from these rows alone.
+        """
+        version = self.dataset_version()
+        changed = pd.concat([added, removed], ignore_index=True)
+        for keys, spec in self.plan.items():
+            path = os.path.join(directory, '-'.join(keys) + '.parquet')
+            if not os.path.exists(path):
+                continue
+            saved = pd.read_parquet(path).set_index(list(keys))
+            saved.columns = pd.MultiIndex.from_tuples([tuple(column.split('|', 1)) for column in saved.columns])
+            if any((column, agg) not in saved.columns for column, aggs in spec.items() for agg in aggs):
+                continue
+
+            touched = changed[list(keys)].drop_duplicates().astype(object)
+            # one isin per key column, for several keys a superset of the touched groups is recomputed
+            in_touched = np.ones(len(self.data), dtype=bool)
+            for key in keys:
+                in_touched &= self.data[key].isin(touched[key].unique()).to_numpy()
+            fresh = self.data[in_touched].groupby(list(keys), observed=True).agg(spec)
+            # a touched group left without rows is dropped with the recomputed ones
+            touched = pd.MultiIndex.from_frame(touched) if len(keys) > 1 else pd.Index(touched[keys[0]])
+            replaced = saved.index.isin(touched) | saved.index.isin(fresh.index)
+            saved = saved.loc[~replaced, list(fresh.columns)]
+            self.results[(version, keys)] = pd.concat([saved, fresh]).sort_index()
+
+        if self.statistics is not None and self.statistics.restore(directory):
+            self.statistics.update(self.data, added, removed)
+            self.statistics_version = version
+
+
+def compress_digest(means: np.ndarray, weights: np.ndarray, compression: int = DIGEST_COMPRESSION):
+    '''
+    merge weighted centroids (or single values of weight 1) into a t-digest like
+    digest of at most `compression` centroids sorted by mean. Centroids are cut
+    on the arcsine scale of their quantile, so the tails keep small centroids
+    and the middle larger ones; inputs that already fit are kept exactly
+
+    Returns:
+    the means and weights of the centroids
+    '''
+    order = np.argsort(means, kind='stable')
+    means, weights = means[order], weights[order]
+    if len(means) <= compression:
+        return means, weights
+    quantile = (np.cumsum(weights) - weights / 2) / weights.sum()
+    bins = np.floor(compression / (2 * np.pi) * np.arcsin(2 * quantile - 1))
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    weight = np.add.reduceat(weights, starts)
+    return np.add.reduceat(means * weights, starts) / weight, weight
+
+
+class PartitionStatistics:
+    '''
+    mergeable statistics of the numeric columns: count, mean, centred sum of
+    squares (m2), min and max per (Country, Year) partition, and one bounded
+    quantile digest per column. describe() and correlations() merge these
+    instead of scanning the rows, and update() adds the partitions of new keys
+    by merging their digests into the kept ones
+    '''
+    def __init__(self, keys=STATISTICS_KEYS, compression: int = DIGEST_COMPRESSION) -> None:
+        self.keys = list(keys)
+        self.compression = compression
+        self.moments = None
+        self.digests = None
+
+    def partition(self, data: pd.DataFrame):
+        """
+        Moments of every partition of the data and the quantile digest of every column.
+        """
+        columns = list(data.select_dtypes('number').columns)
+        grouped = data.groupby(self.keys, observed=True)[columns]
+        count = grouped.count()
+        mean = grouped.mean()
+        moments = pd.concat({
+            'count': count,
+            'mean': mean,
+            'm2': (grouped.var(ddof=0) * count).fillna(0),
+            'min': grouped.min(),
+            'max': grouped.max(),
+        }, axis=1).swaplevel(axis=1).astype('float64')
+
+        digests = {}
+        for column in columns:
+            values = data[column].dropna().to_numpy(dtype='float64')
+            digests[column] = compress_digest(values, np.ones(len(values)), self.compression)
+        return moments, digests
+
+    @instrument
+    def compute(self, data: pd.DataFrame) -> None:
+        """
+        Statistics of every partition of the dataset.
+        """
+        self.moments, self.digests = self.partition(data)
+
+    @instrument
+    def update(self, data: pd.DataFrame, added: pd.DataFrame, removed: pd.DataFrame) -> None:
+        """
+        Bring the statistics to data after an incremental run that replaced the
+        removed rows with the added ones. New partitions are computed from the
+        added rows only, but a digest cannot forget values, so when rows were
+        removed the statistics are recomputed from the whole dataset.
+        """
+        if len(removed):
+            return self.compute(data)
+        if added.empty:
+            return
+        moments, digests = self.partition(added)
+        self.moments = pd.concat([self.moments, moments])
+        for column, (means, weights) in digests.items():
+            kept_means, kept_weights = self.digests.get(column, (np.empty(0), np.empty(0)))
+            self.digests[column] = compress_digest(np.concatenate([kept_means, means]),
+                                                   np.concatenate([kept_weights, weights]), self.compression)
+
+    def describe(self) -> pd.DataFrame:
+        """
+        Same layout as pandas describe(), merged from the partition statistics.
+        """
+        result = {}
+        for column in self.moments.columns.get_level_values(0).unique():
+            moments = self.moments[column]
+            moments = moments[moments['count'] > 0]
+            count = moments['count'].sum()
+            mean = (moments['count'] * moments['mean']).sum() / count
+            m2 = moments['m2'].sum() + (moments['count'] * (moments['mean'] - mean) ** 2).sum()
+            quantiles = self.quantiles(column, [0.25, 0.5, 0.75])
+            result[column] = [count, mean, np.sqrt(m2 / (count - 1)) if count > 1 else np.nan,
+                              moments['min'].min(), *quantiles, moments['max'].max()]
+        return pd.DataFrame(result, index=['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max'])
+
+    def quantiles(self, column: str, q) -> list:
+        """
+        Quantiles interpolated between the centroids of the column digest, exact
+        while the column holds at most `compression` values.
+        """
+        means, weights = self.digests.get(column, (np.empty(0), np.empty(0)))
+        if len(means) == 0:
+            return [np.nan] * len(q)
+        position = np.cumsum(weights) - weights / 2
+        targets = np.asarray(q) * (weights.sum() - 1) + 0.5
+        return list(np.interp(targets, position, means))
+
+    def correlations(self, columns) -> pd.DataFrame:
+        """
+        Correlation matrix of the per country means, merged from the partition counts and means.
+        """
+        country = self.keys[0]
+        moments = self.moments[list(columns)]
+        counts = moments.xs('count', axis=1, level=1)
+        totals = (counts * moments.xs('mean', axis=1, level=1)).groupby(level=country, observed=True).sum()
+        return (totals / counts.groupby(level=country, observed=True).sum()).corr()
+
+    def save(self, directory: str) -> None:
+        """
+        Persist the partition statistics next to the aggregates.
+        """
+        os.makedirs(directory, exist_ok=True)
+        moments = self.moments.copy()
+        moments.columns = [f"{column}|{stat}" for column, stat in moments.columns]
+        moments.reset_index().to_parquet(os.path.join(directory, 'statistics-moments.parquet'), index=False)
+        digests = pd.concat([pd.DataFrame({'column': column, 'mean': means, 'weight': weights})
+                             for column, (means, weights) in self.digests.items()], ignore_index=True)
+        digests.to_parquet(os.path.join(directory, 'statistics-digests.parquet'), index=False)
+
+    def restore(self, directory: str) -> bool:
+        """
+        Load the saved partition statistics, returns False when there are none.
+        """
+        paths = [os.path.join(directory, f'statistics-{name}.parquet') for name in ['moments', 'digests']]
+        if not all(os.path.exists(path) for path in paths):
+            return False
+        moments = pd.read_parquet(paths[0]).set_index(self.keys)
+        moments.columns = pd.MultiIndex.from_tuples([tuple(column.rsplit('|', 1)) for column in moments.columns])
+        self.moments = moments
+        self.digests = {column: (digest['mean'].to_numpy(), digest['weight'].to_numpy())
+                        for column, digest in pd.read_parquet(paths[1]).groupby('column', sort=False)}
+        return True
 
 
 class GenerateReport:
-    def __init__(self, data) -> None:
+    def __init__(self, data, renderer: FigureRenderer = None, aggregates: AggregationCache = None,
+                 figure_path: str = FIGURE_PATH) -> None:
         self.data = data
+        self.figure_path = figure_path
+        self.renderer = renderer
+        self.aggregates = aggregates or AggregationCache(data, REPORT_AGGREGATIONS)
 
+    def export_figure(self, fig, path):
+        """
+        Save the figure now, or queue it when the report renders through a FigureRenderer.
+        """
+        if self.renderer is None:
+            save_figure(fig, path)
+        else:
+            self.renderer.add(fig, path)
+
+    @instrument
     def generate_yield_trend_plot(self):
         """
         Generate a line plot for average yield values over time, grouped by crop.
         """
-        grouped_data = self.data.groupby(['Year', 'crop_types']).agg({'yield_value (hg/ha)': 'mean'}).reset_index()
+        import plotly.express as px
+        grouped_data = self.aggregates.get(['Year', 'crop_types'], {'yield_value (hg/ha)': 'mean'})
         fig = px.line(grouped_data, x='Year', y='yield_value (hg/ha)', color='crop_types', title='Average Yield Values Over Time')
-        save_figure(fig, FIGURE_PATH +'yield_trend_plot.png')
+        self.export_figure(fig, self.figure_path + 'yield_trend_plot.png')
         return fig
 
 
+    @instrument
     def generate_summary_dashboard(self):
         """
         Generate a summary dashboard for average yield and pesticide values.
         """
-        summary = self.data.groupby('crop_types').agg({
+        import plotly.express as px
+        summary = self.aggregates.get(['crop_types'], {
             'yield_value (hg/ha)': 'mean',
             'pest_value (tonnes)': 'mean',
             'average_rain_fall (mm/year)': 'mean'
-        }).reset_index()
+        })
         
         fig = px.bar(summary, x='crop_types', y='yield_value (hg/ha)', title='Average Yield per Crop')
-        save_figure(fig, FIGURE_PATH +'average_yield_per_crop_plot.png')
+        self.export_figure(fig, self.figure_path + 'average_yield_per_crop_plot.png')
         return fig
 
 
 
+    @instrument
     def descriptive_stats(self) -> None:
         """
         Compute descriptive statistics and save to a file.
         """
         
-        desc_stats = self.data.describe()  # Compute descriptive statistics
+        desc_stats = self.aggregates.describe()  # Compute descriptive statistics
 
-        save_csv(desc_stats, FIGURE_PATH +'descriptives.csv')   # Save to a CSV file
+        save_csv(desc_stats, self.figure_path + 'descriptives.csv')   # Save to a CSV file
         
     
         
+    @instrument
     def calculate_correlations(self):
         """
         Calculate and return the correlation matrix for the specified columns, grouped country.
         """
-        grouped_data = self.data.groupby('Country').agg({
-            'pest_value (tonnes)': 'mean',
-            'average_rain_fall (mm/year)': 'mean',
-            'avg_temp (°C)': 'mean',
-            'yield_value (hg/ha)': 'mean'
-        }).reset_index()
-        correlation_matrix = grouped_data[['pest_value (tonnes)', 'average_rain_fall (mm/year)', 'avg_temp (°C)', 'yield_value (hg/ha)']].corr()
+        correlation_matrix = self.aggregates.correlations(['pest_value (tonnes)', 'average_rain_fall (mm/year)', 'avg_temp (°C)', 'yield_value (hg/ha)'])
         return correlation_matrix
 
 
 
+    @instrument
     def visualize_correlations(self, correlation_matrix):
         """
         Generate a heatmap to visualize the correlation matrix.
         """
+        import plotly.express as px
         fig = px.imshow(correlation_matrix, text_auto=True, title='Correlation Matrix')
-        save_figure(fig, FIGURE_PATH +'correlation_matrix.png')
+        self.export_figure(fig, self.figure_path + 'correlation_matrix.png')
         return fig
 
 
+    @instrument
     def plot_rainfall_yield_by_year(self):
         """
         Plots the distribution of pesticide use and rainfall over yield per year using Plotly.
@@ -75,11 +450,12 @@ class GenerateReport:
         Parameters:
         data (pd.DataFrame): DataFrame containing columns 'Year', 'Pesticide', 'Rainfall', and 'Yield'.
         """
+        import plotly.express as px
         
-        avg_data = self.data.groupby('Year').agg({
+        avg_data = self.aggregates.get(['Year'], {
             'average_rain_fall (mm/year)': 'mean',
             'yield_value (hg/ha)': 'mean'
-        }).reset_index()
+        })
 
     
         # Scatter plot for Rainfall vs Yield
@@ -88,10 +464,11 @@ class GenerateReport:
                         labels={'Rainfall': 'Average Rainfall (mm/year)', 'Yield': 'yield_value (hg/ha)', 'Year': 'Year'},
                         hover_name='Year')
         fig.update_traces(marker=dict(line=dict(width=2, color='DarkSlateGrey')))
-        save_figure(fig, FIGURE_PATH +'rainfall_vs_yield_overyears.png')
+        self.export_figure(fig, self.figure_path + 'rainfall_vs_yield_overyears.png')
         return fig
     
 
+    @instrument
     def plot_pesticide_yield_by_year(self):
         """
         Plots the distribution of pesticide use and rainfall over yield per year using Plotly.
@@ -99,10 +476,11 @@ class GenerateReport:
         Parameters:
         data (pd.DataFrame): DataFrame containing columns 'Year', 'Pesticide', 'Rainfall', and 'Yield'.
         """
-        avg_data = self.data.groupby('Year').agg({
+        import plotly.express as px
+        avg_data = self.aggregates.get(['Year'], {
             'pest_value (tonnes)': 'mean',
             'yield_value (hg/ha)': 'mean'
-        }).reset_index()
+        })
         
         # Scatter plot for Pesticide vs Yield
         fig = px.scatter(avg_data, x='Year', y='yield_value (hg/ha)', color='pest_value (tonnes)',
@@ -110,25 +488,29 @@ class GenerateReport:
                         labels={'Pesticide': 'pest_value (tonnes)', 'Yield': 'yield_value (hg/ha)', 'Year': 'Year'},
                         hover_name='Year')
         fig.update_traces(marker=dict(line=dict(width=2, color='DarkSlateGrey')))
-        save_figure(fig, FIGURE_PATH +'pesticide_vs_yield_overyears.png')
+        self.export_figure(fig, self.figure_path + 'pesticide_vs_yield_overyears.png')
         return fig
 
 
+    @instrument
     def plot_yield_vs_continent(self):
         """
         Create a scatter plot of Yield vs Crop types within different continent using Plotly Express.
         """
-        fig = px.scatter(self.data, 
+        import plotly.express as px
+        points = scatter_points(self.data, ['Continent', 'crop_types'])
+        fig = px.scatter(points, 
                             x='crop_types', 
                             y='yield_value (hg/ha)', 
                             color='Continent', 
                             title='Yield vs Crop types within different continent',
                             labels={'Crop_Yield': 'Crop Yield', 'Continent': 'Continent', 'Crop_Type': 'Crop Type'},
-                            hover_data=['Country'])
-        save_figure(fig, FIGURE_PATH +'yield_vs_continent.png')
+                            hover_data=['Country'], render_mode=scatter_render_mode(points))
+        self.export_figure(fig, self.figure_path + 'yield_vs_continent.png')
         return fig
 
 
+    @instrument
     def generate_analyst_report(self):
         """Generates the full report for analysts.
         """
@@ -143,6 +525,7 @@ class GenerateReport:
         return fig
         
 
+    @instrument
     def generate_breeder_report(self):
         """Generates the full report for breeders.
         """
@@ -158,10 +541,12 @@ class GenerateReport:
     
 
 class Report:
-    def __init__(self, data):
+    def __init__(self, data, renderer: FigureRenderer = None, aggregates: AggregationCache = None,
+                 figure_path: str = FIGURE_PATH):
         self.data = data
-        self.generator = GenerateReport(data)
+        self.generator = GenerateReport(data, renderer, aggregates, figure_path)
 
+    @instrument
     def generate(self, user_type='analyst'):
         if user_type == 'analyst':
             print("Generating report for Analysts...\n")
@@ -173,15 +558,28 @@ class Report:
     
 
 class ModelPlot:
-        def __init__(self, model_results):
+        def __init__(self, model_results, renderer: FigureRenderer = None, figure_path: str = FIGURE_PATH):
+            self.renderer = renderer
+            self.figure_path = figure_path
             self.X_train = model_results['X_train']
             self.X_test = model_results['X_test']
             self.y_train = model_results['y_train']
             self.y_test = model_results['y_test']
             self.y_pred = model_results['y_pred']
             self.feature_importance = model_results['feature_importance']
+
+        def export_figure(self, fig, path):
+            """
+            Save the figure now, or queue it when the plots render through a FigureRenderer.
+            """
+            if self.renderer is None:
+                save_figure(fig, path)
+            else:
+                self.renderer.add(fig, path)
             
+        @instrument
         def plot_feature_importance(self):
+            import plotly.express as px
             # Feature Importance Plot
             importance_df = pd.DataFrame({
                 'Feature': self.X_train.columns,
@@ -189,25 +587,98 @@ class ModelPlot:
             }).sort_values(by='Importance', ascending=False)
 
             fig = px.bar(importance_df, x='Feature', y='Importance', title='Feature Importance')
-            save_figure(fig, FIGURE_PATH +'feature_Importance.png')
+            self.export_figure(fig, self.figure_path + 'feature_Importance.png')
             return fig
 
+        @instrument
         def plot_actual_vs_actual(self):
+            import plotly.express as px
             # Actual vs Predicted Plot
-            fig = px.scatter(x=self.y_test.squeeze(), y=self.y_pred.squeeze(), labels={'x': 'Actual', 'y': 'Predicted'}, title='Actual vs Predicted')
+            points = scatter_points(pd.DataFrame({'x': np.asarray(self.y_test).squeeze(), 'y': np.asarray(self.y_pred).squeeze()}))
+            fig = px.scatter(points, x='x', y='y', labels={'x': 'Actual', 'y': 'Predicted'}, title='Actual vs Predicted',
+                             render_mode=scatter_render_mode(points))
             fig.add_shape(type='line', x0=self.y_test.squeeze().min(), x1=self.y_test.squeeze().max(), y0=self.y_test.squeeze().min(), y1=self.y_test.squeeze().max(), line=dict(color='red', dash='dash'))
             #fig_actual_vs_predicted.show()
-            save_figure(fig, FIGURE_PATH +'actual_vs_predicted.png')
+            self.export_figure(fig, self.figure_path + 'actual_vs_predicted.png')
             return fig
 
 
+def scatter_points(data: pd.DataFrame, strata=None, max_rows: int = SCATTER_MAX_ROWS, seed: int = 0) -> pd.DataFrame:
+    """
+    Downsample the rows of a scatter plot to about max_rows, sampling the same
+    fraction of every strata group so that small groups stay visible.
+    """
+    if len(data) <= max_rows:
+        return data
+    if strata:
+        return data.groupby(strata, observed=True, group_keys=False).sample(frac=max_rows / len(data), random_state=seed)
+    return data.sample(n=max_rows, random_state=seed)
+
+
+def scatter_render_mode(points: pd.DataFrame) -> str:
+    """
+    Draw large scatters with webgl (scattergl) rather than svg.
+    """
+    return 'webgl' if len(points) > SCATTER_WEBGL_ROWS else 'svg'
+
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+</head>
+<body>
+<h1>{title}</h1>
+{body}
+</body>
+</html>
+"""
+
+
+@instrument
+def write_html_report(figures: Dict[str, object], path: str, title: str = 'Report') -> str:
+    """
+    Write the {png path: figure} figures into one self-contained html page,
+    plotly.js is embedded once with the first figure.
+    """
+    import plotly.io as pio
+
+    sections = []
+    for i, (figure_path, fig) in enumerate(figures.items()):
+        name = os.path.splitext(os.path.basename(figure_path))[0]
+        div = pio.to_html(fig, full_html=False, include_plotlyjs=i == 0, div_id=name)
+        sections.append(f'<section id="{name}-section">\n{div}\n</section>')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(HTML_TEMPLATE.format(title=title, body='\n'.join(sections)))
+    return path
+
+
+@instrument
 def save_figure(fig, FIGURE_PATH):
     """
     Save the figure to a file.
     """
     fig.write_image(FIGURE_PATH)
+
+
+def render_batch(jobs):
+    """
+    Export a batch of (figure json, path) pairs, reusing a single kaleido
+    session for the whole batch when plotly supports it.
+    """
+    import plotly.io as pio
+
+    figures = [pio.from_json(fig_json) for fig_json, _ in jobs]
+    paths = [path for _, path in jobs]
+    if hasattr(pio, 'write_images'):
+        pio.write_images(figures, paths)
+    else:
+        for fig, path in zip(figures, paths):
+            fig.write_image(path)
     
     
+@instrument
 def save_csv(data, FIGURE_PATH):
     """
     Save the csv to path.
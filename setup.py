@@ -8,6 +8,7 @@ setup(
     version="0.1.0",
     packages=find_packages(include=['pipeline', 'pipeline.*']),
     include_package_data=True,
+    package_data={'pipeline.utils': ['cleaning_rules.json']},
     install_requires=[],  # List any dependencies here
     entry_points={
         'console_scripts': [
@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pipeline.writer.writer import PEST, RAIN, TEMP, YIELD
+
+
+def merged_frame(countries, years, crops=('Maize', 'Wheat'), seed=0) -> pd.DataFrame:
+    """
+    Merged rows with one row per (Country, Year, crop) and random values.
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.MultiIndex.from_product([countries, years, crops], names=['Country', 'Year', 'crop_types'])
+    df = index.to_frame(index=False)
+    df[YIELD] = rng.integers(10_000, 300_000, len(df)).astype('float64')
+    df[PEST] = rng.uniform(0, 20_000, len(df))
+    df[RAIN] = rng.uniform(0, 3_000, len(df))
+    df[TEMP] = rng.uniform(-5, 35, len(df))
+    return df
+
+
+@pytest.fixture
+def merged():
+    return merged_frame(['Albania', 'Brazil', 'Chad'], range(2000, 2010))
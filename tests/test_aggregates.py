@@ -0,0 +1,36 @@
+import pandas as pd
+from pipeline.writer.writer import REPORT_AGGREGATIONS, AggregationCache, PEST, YIELD
+
+
+def test_get_matches_groupby(merged):
+    aggregates = AggregationCache(merged, REPORT_AGGREGATIONS)
+    result = aggregates.get(['Year', 'crop_types'], {YIELD: 'mean'})
+    expected = merged.groupby(['Year', 'crop_types'])[YIELD].mean().reset_index()
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_key_set_is_computed_once(merged, monkeypatch):
+    aggregates = AggregationCache(merged, REPORT_AGGREGATIONS)
+    computed = []
+    compute = aggregates.compute
+    monkeypatch.setattr(aggregates, 'compute', lambda keys: computed.append(keys) or compute(keys))
+
+    aggregates.get(['crop_types'], {YIELD: 'mean'})
+    aggregates.get(['crop_types'], {PEST: 'mean'})
+    assert computed == [('crop_types',)]
+    # an aggregation outside the plan is registered and the key set computed again
+    result = aggregates.get(['crop_types'], {YIELD: 'max'})
+    assert computed == [('crop_types',), ('crop_types',)]
+    pd.testing.assert_frame_equal(result, merged.groupby('crop_types')[YIELD].max().reset_index())
+
+
+def test_set_data_drops_the_cached_aggregates(merged):
+    aggregates = AggregationCache(merged, REPORT_AGGREGATIONS)
+    aggregates.get(['Year'], {YIELD: 'mean'})
+    version = aggregates.dataset_version()
+
+    doubled = merged.assign(**{YIELD: merged[YIELD] * 2})
+    aggregates.set_data(doubled)
+    assert aggregates.dataset_version() != version and aggregates.results == {}
+    pd.testing.assert_frame_equal(aggregates.get(['Year'], {YIELD: 'mean'}),
+                                  doubled.groupby('Year')[YIELD].mean().reset_index())
@@ -0,0 +1,64 @@
+import json
+import os
+import pytest
+from pipeline.utils.batch import BatchRunner, dataset_jobs, estimate_memory, parse_memory, read_manifest
+
+
+def record_job(job):
+    """
+    Stands in for the pipeline of a dataset, run in the batch worker process.
+    """
+    if job['name'] == 'broken':
+        raise ValueError('no yield.csv')
+    with open(os.path.join(job['log_dir'], job['name']), 'w') as outfile:
+        outfile.write(str(os.getpid()))
+
+
+def test_parse_memory():
+    assert parse_memory('512MB') == 512 * 2**20
+    assert parse_memory(' 1.5 gb ') == int(1.5 * 2**30)
+    assert parse_memory('1024') == 1024
+    with pytest.raises(ValueError, match='invalid memory size'):
+        parse_memory('lots')
+
+
+def test_read_manifest(tmp_path):
+    manifest = tmp_path / 'datasets.txt'
+    manifest.write_text('# regional drops\neast\n\n/data/west\n')
+    assert read_manifest(str(manifest)) == [{'data_dir': str(tmp_path / 'east')}, {'data_dir': '/data/west'}]
+
+
+def test_dataset_jobs_have_unique_names(tmp_path):
+    jobs = dataset_jobs([{'data_dir': '/a/east'}, {'data_dir': '/b/east/'}, {'data_dir': '/c', 'name': 'west'}],
+                        str(tmp_path))
+    assert [job['name'] for job in jobs] == ['east', 'east-2', 'west']
+    assert jobs[1]['output_dir'] == str(tmp_path / 'east-2')
+    assert dataset_jobs([{'data_dir': '/a/east'}])[0]['output_dir'] is None
+
+
+def test_every_dataset_runs_in_its_own_process(tmp_path):
+    jobs = [{'name': name, 'data_dir': str(tmp_path / name), 'output_dir': None, 'log_dir': str(tmp_path)}
+            for name in ['east', 'broken', 'west']]
+    results = BatchRunner(record_job, jobs=2).run(jobs)
+    assert results['east'] == results['west'] == 'ok'
+    assert results['broken'] == 'failed: ValueError: no yield.csv'
+    pids = {(tmp_path / name).read_text() for name in ['east', 'west']}
+    assert len(pids) == 2 and str(os.getpid()) not in pids
+
+
+def test_memory_budget_limits_the_running_datasets(tmp_path):
+    # the previous run reports give the estimates, a 4GB budget runs the 3GB datasets one at a time
+    jobs = []
+    for name, report in [('east', {'records': [{'peak_rss_bytes': 3 * 2**30}]}),
+                         ('west', {'records': [], 'stages': {'combine': {'peak_rss_bytes': 3 * 2**30}}})]:
+        figures = tmp_path / name / 'output'
+        figures.mkdir(parents=True)
+        (figures / 'run_report.json').write_text(json.dumps(report))
+        jobs.append({'name': name, 'data_dir': str(tmp_path / name), 'output_dir': None})
+    assert [estimate_memory(job) for job in jobs] == [3 * 2**30, 3 * 2**30]
+
+    jobs = [{**job, 'memory': estimate_memory(job)} for job in jobs]
+    runner = BatchRunner(record_job, jobs=2, memory_budget=4 * 2**30)
+    assert runner.fits(jobs[0], {})
+    assert not runner.fits(jobs[1], {'east': jobs[0]})
+    assert BatchRunner(record_job, jobs=2).fits(jobs[1], {'east': jobs[0]})
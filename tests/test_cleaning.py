@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pipeline.processors.processor import CleaningRules
+from pipeline.utils.constants import CLEANING_RULES_FILE
+
+RAIN = 'average_rain_fall (mm/year)'
+
+
+@pytest.fixture
+def raw():
+    return pd.DataFrame({
+        'Country': ["CÃ´te D'Ivoire", 'Albania', "Cote d'Ivoire", None, 'Albania'],
+        RAIN: ['1200', '..', None, '-5', '2'],
+        'avg_temp (°C)': [15.0, 75.0, -70.0, 20.0, np.nan],
+        'yield_value (hg/ha)': [100.0, -1.0, 50.0, 0.0, 7.0],
+    })
+
+
+def test_rules_file(raw):
+    rules = CleaningRules.from_file(CLEANING_RULES_FILE)
+    df = rules.apply(raw)
+    assert df['Country'].tolist()[:3] == ["Côte d'Ivoire", 'Albania', "Côte d'Ivoire"]
+    assert df[RAIN].tolist() == [1200, 0, 0, 0, 2] and df[RAIN].dtype == 'int64'
+    assert df['avg_temp (°C)'].isna().tolist() == [False, True, True, False, True]
+    assert df['yield_value (hg/ha)'].isna().tolist() == [False, True, False, False, False]
+    # the input frame is left as it was
+    assert raw[RAIN].tolist() == ['1200', '..', None, '-5', '2']
+    assert rules.get_report() == {
+        'country_encoding': 1, 'country_names': 2, 'rainfall_missing': 2, 'rainfall_to_int': 0,
+        'rainfall_non_negative': 1, 'temperature_range': 2, 'values_non_negative': 1,
+    }
+
+
+def test_report_adds_up_over_frames(raw):
+    rules = CleaningRules.from_file(CLEANING_RULES_FILE)
+    rules.apply(raw)
+    # rules naming absent columns are skipped
+    rules.apply(raw[['Country']])
+    assert rules.get_report()['country_encoding'] == 2 and rules.get_report()['rainfall_missing'] == 2
+
+
+def test_string_rules_keep_categories():
+    rules = CleaningRules([{'name': 'names', 'type': 'replace', 'columns': ['Country'], 'mapping': {'A': 'B'}}])
+    df = rules.apply(pd.DataFrame({'Country': pd.Categorical(['A', None, 'B', 'C', 'A'])}))
+    assert isinstance(df['Country'].dtype, pd.CategoricalDtype)
+    assert df['Country'].tolist() == ['B', np.nan, 'B', 'C', 'B']
+    assert rules.get_report() == {'names': 2}
+
+
+def test_cast_and_range_rules():
+    rules = CleaningRules([
+        {'name': 'to_float', 'type': 'cast', 'columns': ['value'], 'dtype': 'float32'},
+        {'name': 'capped', 'type': 'range', 'columns': ['value'], 'max': 10, 'action': 'clip'},
+    ])
+    df = rules.apply(pd.DataFrame({'value': ['1.5', 'n/a', '30']}))
+    assert df['value'].dtype == 'float32'
+    np.testing.assert_array_equal(df['value'].to_numpy(), np.array([1.5, np.nan, 10], dtype='float32'))
+    assert rules.get_report() == {'to_float': 1, 'capped': 1}
+
+
+def test_rule_errors():
+    with pytest.raises(ValueError, match='unknown cleaning rule types'):
+        CleaningRules([{'name': 'odd', 'type': 'regex', 'columns': ['Country']}])
+    rules = CleaningRules([{'name': 'to_int', 'type': 'cast', 'columns': ['value'], 'dtype': 'int64'}])
+    with pytest.raises(ValueError, match='cannot be cast to int64'):
+        rules.apply(pd.DataFrame({'value': ['1', None]}))
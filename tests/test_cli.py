@@ -0,0 +1,74 @@
+import json
+import pytest
+import main
+
+
+def parse_error(argv, capsys):
+    with pytest.raises(SystemExit) as error:
+        main.parse_args(argv)
+    assert error.value.code == 2
+    return capsys.readouterr().err
+
+
+def test_defaults():
+    args = main.parse_args([])
+    assert args.role == ['analyst'] and args.stages is None and args.rerun is None
+    assert args.datasets == [{'data_dir': main.DATA_DIR}]
+
+
+def test_roles_and_formats_are_split():
+    args = main.parse_args(['--role', 'analyst, breeder', '--format', 'html,png'])
+    assert args.role == ['analyst', 'breeder'] and args.format == ['html', 'png']
+
+
+@pytest.mark.parametrize('argv, message', [
+    (['--role', 'farmer'], '--role expects'),
+    (['--role', ','], '--role expects'),
+    (['--format', 'pdf'], '--format expects'),
+    (['--stages', 'combine,plots'], "unknown stages ['plots']"),
+    (['--rerun', 'plots'], "unknown stages ['plots']"),
+    (['--skip-model', '--stages', 'train'], "unknown stages ['train']"),
+    (['--jobs', '0'], '--jobs expects at least 1'),
+    (['--memory-budget', 'lots'], 'invalid memory size'),
+    (['--backend', 'duckdb', '--incremental'], '--incremental is only supported'),
+])
+def test_invalid_arguments_are_usage_errors(argv, message, capsys):
+    assert message in parse_error(argv, capsys)
+
+
+def test_manifest(tmp_path, capsys):
+    manifest = tmp_path / 'datasets.json'
+    manifest.write_text(json.dumps(['east', {'data_dir': 'west', 'name': 'w'}]))
+    args = main.parse_args(['--manifest', str(manifest), '--memory-budget', '1GB'])
+    assert args.datasets == [{'data_dir': str(tmp_path / 'east')}, {'data_dir': str(tmp_path / 'west'), 'name': 'w'}]
+    assert args.memory_budget == 2**30
+
+    manifest.write_text('[]')
+    assert 'lists no data directories' in parse_error(['--manifest', str(manifest)], capsys)
+    assert 'cannot read the manifest' in parse_error(['--manifest', str(tmp_path / 'missing.txt')], capsys)
+
+
+class RecordingGraph:
+    """
+    Stands in for the stage graph, recording what it is asked to run.
+    """
+    stages = {'read_rain': None, 'continents': None, 'combine': None, 'report': None}
+    memory_report = {}
+    runs = []
+
+    def run(self, targets=None, rerun=()):
+        self.runs.append((targets, list(rerun)))
+
+
+@pytest.mark.parametrize('argv, expected', [
+    ([], (None, [])),
+    (['--stages', 'report'], (['report'], [])),
+    (['--rerun', 'combine'], (['combine'], ['combine'])),
+    (['--stages', 'report', '--rerun', 'read_rain'], (['report', 'read_rain'], ['read_rain'])),
+])
+def test_rerun_adds_to_the_stages(argv, expected, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'build_pipeline', lambda *args, **kwargs: RecordingGraph())
+    monkeypatch.setattr(RecordingGraph, 'runs', [])
+    args = main.parse_args(argv + ['--run-report', str(tmp_path / 'run_report.json')])
+    main.run_dataset(args, str(tmp_path), str(tmp_path / 'output'))
+    assert RecordingGraph.runs == [expected]
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+from pipeline.processors.processor import CombineSources, merge_data
+
+KEYS = ['Country', 'Year']
+COLUMNS = {
+    'pesticide': {'Value': 'pest_value (tonnes)'},
+    'rain': {'rain': 'average_rain_fall (mm/year)'},
+    'yield': {'Item': 'crop_types', 'Value': 'yield_value (hg/ha)'},
+}
+
+
+def sources():
+    return {
+        'pesticide': pd.DataFrame({'Country': ['Albania', 'Albania', 'Brazil', 'Chad'],
+                                   'Year': [2000, 2001, 2000, 2000],
+                                   'Unit': 'tonnes', 'Value': [1.0, 2.0, 3.0, 4.0]}),
+        'rain': pd.DataFrame({'Country': ['Albania', 'Albania', 'Brazil', None],
+                              'Year': [2000, 2001, 2000, 2000], 'rain': [10.0, 20.0, 30.0, 40.0]}),
+        # two crops for a key, which the join repeats, and a year only this source has
+        'yield': pd.DataFrame({'Country': ['Albania', 'Albania', 'Albania', 'Brazil', 'Brazil'],
+                               'Year': [2000, 2000, 2001, 2000, 2002],
+                               'Item': ['Maize', 'Wheat', 'Maize', 'Maize', 'Maize'],
+                               'Value': [100.0, 200.0, 300.0, 400.0, 500.0]}),
+    }
+
+
+def chained_merge(frames):
+    # the join the pipeline did before CombineSources, one merge_data per source
+    projected = [df[KEYS + list(COLUMNS[name])].rename(columns=COLUMNS[name]) for name, df in frames.items()]
+    merged = projected[0]
+    for frame in projected[1:]:
+        merged = merge_data(merged, frame, KEYS)
+    return merged
+
+
+def sort(df):
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+
+def test_merge_matches_chained_merge_data():
+    combine = CombineSources(sources(), COLUMNS, KEYS)
+    expected = chained_merge(sources())
+    result = combine.merge(list(expected.columns))
+    pd.testing.assert_frame_equal(sort(result), sort(expected))
+
+
+def test_merge_report_counts_dropped_rows():
+    combine = CombineSources(sources(), COLUMNS, KEYS)
+    combine.merge()
+    assert combine.get_merge_report() == {
+        'pesticide': {'rows': 4, 'dropped': 1},
+        'rain': {'rows': 4, 'dropped': 1},
+        'yield': {'rows': 5, 'dropped': 1},
+    }
+
+
+def test_merge_without_common_keys_is_empty():
+    frames = sources()
+    frames['rain'] = frames['rain'].assign(Year=1900)
+    column_order = KEYS + [column for names in COLUMNS.values() for column in names.values()]
+    result = CombineSources(frames, COLUMNS, KEYS).merge(column_order)
+    assert result.empty and list(result.columns) == column_order
+
+
+def test_encode_keys_marks_missing_keys():
+    combine = CombineSources(sources(), COLUMNS, KEYS)
+    encoded, size = combine.encode_keys(sources())
+    assert encoded['rain'][3] == -1
+    # equal keys get the same code across the sources
+    assert encoded['pesticide'][0] == encoded['rain'][0] == encoded['yield'][0]
+    assert len(np.unique(encoded['yield'])) == 4
+    assert size == 3 * 3
+
+
+def test_categorical_keys_share_categories_and_stay_categorical():
+    frames = {name: df.astype({'Country': 'category', 'Year': 'int16'}) for name, df in sources().items()}
+    combine = CombineSources(frames, COLUMNS, KEYS)
+    expected = chained_merge(sources())
+    result = combine.merge(list(expected.columns))
+    assert result['Country'].dtype == 'category'
+    pd.testing.assert_frame_equal(sort(result.astype({'Country': object, 'Year': 'int64'})), sort(expected))
+    # the report does not depend on the key dtypes
+    assert combine.get_merge_report() == CombineSources(sources(), COLUMNS, KEYS).count_dropped(
+        {name: df[KEYS] for name, df in sources().items()})
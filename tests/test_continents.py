@@ -0,0 +1,61 @@
+import pandas as pd
+import pytest
+from pipeline.processors.processor import TranformRawData, load_continent_table, save_continent_table
+from pipeline.utils.constants import CONTINENT_OVERRIDES
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """
+    Stand in for the pycountry lookup, recording the countries it is asked for.
+    """
+    asked = []
+    known = {'Albania': 'Europe', 'Brazil': 'South America', 'Chad': 'Africa'}
+
+    def get_continent(self, country):
+        asked.append(country)
+        return known.get(country)
+
+    monkeypatch.setattr(TranformRawData, 'get_continent', get_continent)
+    return asked
+
+
+def test_continent_table_round_trip(tmp_path):
+    path = str(tmp_path / 'shared' / 'continents.csv')
+    assert load_continent_table(path) == {}
+    save_continent_table({'Namibia': 'Africa', 'Albania': 'Europe'}, path)
+    # 'NA' stays a name, not a missing value
+    assert load_continent_table(path) == {'Albania': 'Europe', 'Namibia': 'Africa'}
+
+
+def test_map_continent_resolves_each_country_once(tmp_path, lookups):
+    df = pd.DataFrame({'Country': ['Albania', 'Brazil', 'Albania', None, 'Brazil']})
+    result = TranformRawData(df, 'Country', str(tmp_path / 'continents.csv')).map_continent()
+    assert result['Continent'].tolist() == ['Europe', 'South America', 'Europe', None, 'South America']
+    assert sorted(lookups) == ['Albania', 'Brazil']
+
+
+def test_overrides_and_table_skip_the_lookup(tmp_path, lookups):
+    path = str(tmp_path / 'continents.csv')
+    save_continent_table({'Albania': 'Europe'}, path)
+    override = next(iter(CONTINENT_OVERRIDES))
+    mapping = TranformRawData(None, 'Country', path).get_continent_mapping(['Albania', override, 'Chad'])
+    assert mapping == {'Albania': 'Europe', override: CONTINENT_OVERRIDES[override], 'Chad': 'Africa'}
+    assert lookups == ['Chad']
+    # the table is extended with what was resolved
+    assert load_continent_table(path) == mapping
+
+
+def test_unresolved_countries_warn_and_are_not_saved(tmp_path, lookups):
+    path = str(tmp_path / 'continents.csv')
+    with pytest.warns(UserWarning, match='Atlantis'):
+        mapping = TranformRawData(None, 'Country', path).get_continent_mapping(['Atlantis', 'Chad'])
+    assert mapping == {'Atlantis': None, 'Chad': 'Africa'}
+    assert load_continent_table(path) == {'Chad': 'Africa'}
+
+
+def test_get_continent_with_pycountry():
+    pytest.importorskip('pycountry_convert')
+    transform = TranformRawData(None, 'Country')
+    assert transform.get_continent('Albania') == 'Europe'
+    assert transform.get_continent('Atlantis') is None
@@ -0,0 +1,109 @@
+import os
+import pandas as pd
+import pytest
+from pipeline.utils.dag import StageGraph
+
+
+@pytest.fixture
+def graph(tmp_path):
+    """
+    read -> clean -> report, with the calls of every stage counted.
+    """
+    source = tmp_path / 'source.csv'
+    source.write_text('value\n1\n2\n')
+    calls = {'read': 0, 'clean': 0, 'report': 0}
+
+    def stage(name, func):
+        def run(*args):
+            calls[name] += 1
+            return func(*args)
+        return run
+
+    graph = StageGraph(str(tmp_path / 'checkpoints'), workers=2)
+    graph.add('read', stage('read', lambda: pd.read_csv(source)), checkpoint='frame', inputs=[str(source)])
+    graph.add('clean', stage('clean', lambda df: df.assign(value=df['value'] * 2)), ['read'], checkpoint='frame')
+    graph.add('report', stage('report', lambda df: int(df['value'].sum())), ['clean'])
+    graph.calls = calls
+    graph.source = source
+    return graph
+
+
+def rebuild(graph):
+    # a new run of the pipeline: same stages, keys computed afresh
+    fresh = StageGraph(graph.checkpoint_dir, graph.workers)
+    fresh.stages, fresh.calls, fresh.source = graph.stages, graph.calls, graph.source
+    return fresh
+
+
+def test_first_run_runs_every_stage(graph):
+    assert graph.plan(['report']) == {'report': 'run', 'clean': 'run', 'read': 'run'}
+    assert graph.run()['report'] == 6
+    assert graph.calls == {'read': 1, 'clean': 1, 'report': 1}
+
+
+def test_checkpoints_are_loaded(graph):
+    graph.run()
+    graph = rebuild(graph)
+    # the report has no checkpoint, it runs from the loaded clean stage
+    assert graph.plan(['report']) == {'report': 'run', 'clean': 'load'}
+    assert graph.run()['report'] == 6
+    assert graph.calls == {'read': 1, 'clean': 1, 'report': 2}
+
+
+def test_rerun_ignores_the_checkpoint_of_the_stage_only(graph):
+    graph.run()
+    graph = rebuild(graph)
+    assert graph.plan(['clean'], rerun={'clean'}) == {'clean': 'run', 'read': 'load'}
+    graph.run(targets=['clean'], rerun=['clean'])
+    assert graph.calls == {'read': 1, 'clean': 2, 'report': 1}
+
+
+def test_changed_input_invalidates_downstream_stages(graph):
+    graph.run()
+    graph.source.write_text('value\n1\n2\n3\n')
+    graph = rebuild(graph)
+    assert graph.plan(['report']) == {'report': 'run', 'clean': 'run', 'read': 'run'}
+    assert graph.run()['report'] == 12
+
+
+def test_replaced_checkpoints_are_pruned(graph):
+    graph.run()
+    graph.source.write_text('value\n5\n')
+    graph = rebuild(graph)
+    graph.run()
+    names = sorted(name.split('-')[0] for name in os.listdir(graph.checkpoint_dir))
+    assert names == ['clean', 'read']
+    assert all(graph.has_checkpoint(name) for name in names)
+
+
+def test_unknown_stages_are_rejected(graph):
+    with pytest.raises(ValueError):
+        graph.plan(['missing'])
+    with pytest.raises(ValueError):
+        graph.add('late', lambda df: df, ['missing'])
+    with pytest.raises(ValueError):
+        graph.add('odd', lambda: None, checkpoint='csv')
+
+
+def test_a_new_country_in_the_shared_table_keeps_the_combine_key(tmp_path):
+    from main import build_pipeline
+    from pipeline.processors.processor import save_continent_table
+    from pipeline.utils.constants import get_data_paths
+
+    paths = get_data_paths(str(tmp_path / 'dataset'), shared_dir=str(tmp_path / 'shared'))
+    os.makedirs(os.path.dirname(paths['yield']), exist_ok=True)
+    for name in ['pesticide', 'rain', 'temperature', 'yield']:
+        with open(paths[name], 'w') as outfile:
+            outfile.write('Country;Year;Value\nAlbania;1990;1.5\n')
+
+    def keys():
+        graph = build_pipeline(['analyst'], paths, skip_model=True)
+        return {name: graph.stage_key(name) for name in ['continents', 'combine']}
+
+    before = keys()
+    # another dataset of the batch resolves a country the table did not hold
+    save_continent_table({'Atlantis': 'Europe'}, paths['continents'])
+    assert keys() == before
+    with open(paths['yield'], 'a') as outfile:
+        outfile.write('Brazil;1990;2.5\n')
+    assert all(key != before[name] for name, key in keys().items())
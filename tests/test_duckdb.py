@@ -0,0 +1,57 @@
+import pandas as pd
+import pytest
+from benchmarks.synthetic import generate_datasets
+from pipeline.processors.processor import CleaningRules
+from pipeline.reader.reader import read_csv_file, read_rain_data, read_temp_file
+from pipeline.utils.constants import (CLEANING_RULES_FILE, NA_VALUES, PESTICIDE_SCHEMA, RAIN_SCHEMA, TEMPERATURE_SCHEMA,
+                                      YIELD_SCHEMA, get_data_paths)
+
+pytest.importorskip('duckdb')
+pytest.importorskip('pycountry_convert')
+
+KEYS = ['Country', 'Year', 'crop_types']
+
+
+@pytest.fixture(scope='module')
+def paths(tmp_path_factory):
+    return get_data_paths(generate_datasets(str(tmp_path_factory.mktemp('agri')), 600))
+
+
+def pandas_path(paths):
+    from main import combine_and_transform
+
+    rules = CleaningRules.from_file(CLEANING_RULES_FILE)
+    sources = {
+        'pesticide': read_csv_file(paths['pesticide'], ';', schema=PESTICIDE_SCHEMA),
+        'rain': read_rain_data(paths['rain'], schema=RAIN_SCHEMA, na_values=NA_VALUES).rename(
+            columns={'country': 'Country', 'year': 'Year'}),
+        'temperature': read_temp_file(paths['temperature'], 'ISO-8859-1', schema=TEMPERATURE_SCHEMA),
+        'yield': read_csv_file(paths['yield'], ';', schema=YIELD_SCHEMA),
+    }
+    merged = combine_and_transform({name: rules.apply(df) for name, df in sources.items()}, paths['continents'], rules)
+    return merged, rules.get_report()
+
+
+def normalise(df):
+    df = df.astype({'Country': str, 'crop_types': str, 'Year': 'int64'})
+    numeric = [column for column in df.columns if column not in KEYS + ['Continent']]
+    return df.astype({column: 'float64' for column in numeric}).sort_values(KEYS + numeric).reset_index(drop=True)
+
+
+@pytest.mark.filterwarnings('ignore:no continent found')
+def test_duckdb_matches_the_pandas_path(paths):
+    from pipeline.processors.duckdb_backend import DuckDBPipeline
+
+    expected, report = pandas_path(paths)
+    rules = CleaningRules.from_file(CLEANING_RULES_FILE)
+    database = DuckDBPipeline(paths, rules)
+    assert database.build() == len(expected)
+    merged = database.query("SELECT * FROM merged")
+    assert list(merged.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(normalise(merged), normalise(expected), rtol=1e-5)
+    # the rules are counted on the source rows for names and on the joined rows for values
+    assert rules.get_report() == report
+    assert rules.get_report()['rainfall_missing'] > 0
+    # the staged copies of the sources are not left in the database
+    tables = database.query("SELECT table_name FROM information_schema.tables")['table_name'].tolist()
+    assert not [table for table in tables if table.startswith('staged_')]
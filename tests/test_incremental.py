@@ -0,0 +1,186 @@
+import pandas as pd
+import pytest
+from pipeline.processors.incremental import IncrementalStore
+from pipeline.writer.writer import REPORT_AGGREGATIONS, AggregationCache, YIELD
+from tests.conftest import merged_frame
+
+KEYS = ['Country', 'Year']
+
+
+def build(sources):
+    return pd.merge(sources['rain'], sources['yield'], on=KEYS, how='inner')
+
+
+def source(rows, column):
+    return pd.DataFrame(rows, columns=KEYS + [column])
+
+
+@pytest.fixture
+def store(tmp_path):
+    return IncrementalStore(str(tmp_path / 'store'))
+
+
+@pytest.fixture
+def sources():
+    return {
+        'rain': source([('Albania', 2000, 1.0), ('Albania', 2001, 2.0), ('Brazil', 2000, 3.0)], 'rain'),
+        'yield': source([('Albania', 2000, 10.0), ('Albania', 2001, 20.0), ('Brazil', 2000, 30.0)], 'yield'),
+    }
+
+
+def update(store, sources, tmp_path):
+    # the watermarks hash the input files, so every source is written out first
+    paths = {}
+    for name, df in sources.items():
+        paths[name] = str(tmp_path / f"{name}.csv")
+        df.to_csv(paths[name], index=False)
+    return store.update(sources, paths, build)
+
+
+def sort(df):
+    return df.sort_values(KEYS).reset_index(drop=True)
+
+
+def test_first_run_builds_everything(store, sources, tmp_path):
+    merged, affected = update(store, sources, tmp_path)
+    assert affected is None
+    pd.testing.assert_frame_equal(sort(merged), sort(build(sources)))
+
+
+def test_no_change_returns_stored_rows(store, sources, tmp_path):
+    update(store, sources, tmp_path)
+    merged, affected = update(store, sources, tmp_path)
+    assert affected is not None and affected.empty
+    pd.testing.assert_frame_equal(sort(merged), sort(build(sources)))
+
+
+def test_new_country_is_appended(store, sources, tmp_path):
+    update(store, sources, tmp_path)
+    sources['rain'] = pd.concat([sources['rain'], source([('Chad', 1990, 4.0)], 'rain')], ignore_index=True)
+    sources['yield'] = pd.concat([sources['yield'], source([('Chad', 1990, 40.0)], 'yield')], ignore_index=True)
+
+    merged, affected = update(store, sources, tmp_path)
+    assert affected.values.tolist() == [['Chad', 1990]]
+    pd.testing.assert_frame_equal(sort(merged), sort(build(sources)))
+
+
+def test_new_year_only_affects_its_keys(store, sources, tmp_path):
+    update(store, sources, tmp_path)
+    sources['rain'] = pd.concat([sources['rain'], source([('Albania', 2002, 5.0)], 'rain')], ignore_index=True)
+    sources['yield'] = pd.concat([sources['yield'], source([('Albania', 2002, 50.0)], 'yield')], ignore_index=True)
+
+    merged, affected = update(store, sources, tmp_path)
+    assert affected.values.tolist() == [['Albania', 2002]]
+    pd.testing.assert_frame_equal(sort(merged), sort(build(sources)))
+
+
+def test_revision_in_place_rebuilds_its_key(store, sources, tmp_path):
+    update(store, sources, tmp_path)
+    sources['yield'].loc[0, 'yield'] = 99.0
+
+    merged, affected = update(store, sources, tmp_path)
+    assert affected.values.tolist() == [['Albania', 2000]]
+    pd.testing.assert_frame_equal(sort(merged), sort(build(sources)))
+    # the new key hashes are stored, so the next run finds nothing new
+    merged, affected = update(store, sources, tmp_path)
+    assert affected.empty and sort(merged).loc[0, 'yield'] == 99.0
+
+
+def test_revision_below_the_latest_year_with_new_rows(store, sources, tmp_path):
+    # a data drop that appends a year and revises an older one in the same file
+    update(store, sources, tmp_path)
+    sources['rain'] = pd.concat([sources['rain'], source([('Albania', 2002, 5.0)], 'rain')], ignore_index=True)
+    sources['yield'] = pd.concat([sources['yield'], source([('Albania', 2002, 50.0)], 'yield')], ignore_index=True)
+    sources['yield'].loc[0, 'yield'] = 99.0
+
+    merged, affected = update(store, sources, tmp_path)
+    assert sorted(affected.values.tolist()) == [['Albania', 2000], ['Albania', 2002]]
+    pd.testing.assert_frame_equal(sort(merged), sort(build(sources)))
+
+
+def test_removed_rows_are_dropped(store, sources, tmp_path):
+    update(store, sources, tmp_path)
+    sources['rain'] = sources['rain'].iloc[1:]
+
+    merged, affected = update(store, sources, tmp_path)
+    assert affected.values.tolist() == [['Albania', 2000]]
+    pd.testing.assert_frame_equal(sort(merged), sort(build(sources)))
+
+
+def test_reordered_rows_change_no_key(store, sources, tmp_path):
+    update(store, sources, tmp_path)
+    sources['yield'] = sources['yield'].iloc[::-1]
+    merged, affected = update(store, sources, tmp_path)
+    assert affected.empty
+
+
+def test_changed_source_set_rebuilds(store, sources, tmp_path):
+    update(store, sources, tmp_path)
+    sources['temperature'] = source([('Albania', 2000, 15.0)], 'temperature')
+    assert update(store, sources, tmp_path)[1] is None
+
+
+def test_key_hashes_ignore_row_order_and_dtypes(store):
+    df = source([('Albania', 2000, 1.0), ('Albania', 2000, 2.0), ('Brazil', 2000, 3.0)], 'rain')
+    hashes = store.key_hashes(df)
+    reordered = df.iloc[::-1].astype({'Country': 'category', 'Year': 'int16'})
+    pd.testing.assert_series_equal(store.key_hashes(reordered).sort_index(), hashes.sort_index())
+    # a repeated row is a change
+    doubled = pd.concat([df, df.iloc[:1]])
+    assert store.key_hashes(doubled)[('Albania', 2000)] != hashes[('Albania', 2000)]
+
+
+def test_update_keeps_the_replaced_and_new_rows(store, sources, tmp_path):
+    update(store, sources, tmp_path)
+    assert store.added is None and store.removed is None
+    sources['yield'].loc[0, 'yield'] = 99.0
+    update(store, sources, tmp_path)
+    assert store.removed.values.tolist() == [['Albania', 2000, 1.0, 10.0]]
+    assert store.added.values.tolist() == [['Albania', 2000, 1.0, 99.0]]
+    update(store, sources, tmp_path)
+    assert store.added.empty and store.removed.empty
+
+
+def test_restore_matches_a_full_compute(merged, tmp_path):
+    previous = AggregationCache(merged, REPORT_AGGREGATIONS, partitioned=True)
+    for keys in previous.plan:
+        previous.compute(keys)
+    previous.partition_statistics()
+    previous.save(str(tmp_path))
+
+    # an incremental run appends a new year and a new country, revises a key and
+    # drops the first year, whose groups must not be restored
+    added = pd.concat([merged_frame(['Albania', 'Brazil', 'Chad'], [2010], seed=1),
+                       merged_frame(['Denmark'], range(2001, 2011), seed=2)], ignore_index=True)
+    revised = (merged['Country'] == 'Chad') & (merged['Year'] == 2005)
+    added = pd.concat([added, merged[revised].assign(**{YIELD: 1.0})], ignore_index=True)
+    removed = merged[revised | (merged['Year'] == 2000)]
+    data = pd.concat([merged.drop(removed.index), added], ignore_index=True)
+
+    restored = AggregationCache(data, REPORT_AGGREGATIONS, partitioned=True)
+    restored.restore(str(tmp_path), added, removed)
+    fresh = AggregationCache(data, REPORT_AGGREGATIONS)
+    for keys in fresh.plan:
+        pd.testing.assert_frame_equal(restored.results[(restored.dataset_version(), keys)], fresh.compute(keys))
+    # rows were removed, so the statistics were recomputed and are exact
+    assert restored.statistics_version == restored.dataset_version()
+    pd.testing.assert_frame_equal(restored.describe(), data.describe())
+
+
+def test_restore_of_appended_rows_merges_the_statistics(merged, tmp_path):
+    previous = AggregationCache(merged, REPORT_AGGREGATIONS, partitioned=True)
+    previous.partition_statistics()
+    previous.save(str(tmp_path))
+
+    added = merged_frame(['Albania', 'Brazil', 'Chad'], [2010], seed=1)
+    data = pd.concat([merged, added], ignore_index=True)
+    restored = AggregationCache(data, REPORT_AGGREGATIONS, partitioned=True)
+    restored.restore(str(tmp_path), added, added.iloc[:0])
+    assert len(restored.statistics.moments) == data[KEYS].drop_duplicates().shape[0]
+    pd.testing.assert_frame_equal(restored.describe(), data.describe())
+
+
+def test_restore_without_saved_aggregates(merged, tmp_path):
+    aggregates = AggregationCache(merged, REPORT_AGGREGATIONS, partitioned=True)
+    aggregates.restore(str(tmp_path), merged, merged.iloc[:0])
+    assert aggregates.results == {} and aggregates.statistics_version is None
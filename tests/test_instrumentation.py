@@ -0,0 +1,35 @@
+import json
+import pandas as pd
+from pipeline.utils.instrumentation import RunReport, instrumented
+
+
+def record(report, stage, rows=1):
+    with instrumented(stage, rows, report=report) as entry:
+        entry['rows_out'] = rows
+
+
+def test_records_are_bounded_and_totals_cover_every_call(tmp_path):
+    report = RunReport(max_records=3)
+    for i in range(5):
+        record(report, 'predict' if i % 2 else 'read', rows=10)
+    assert len(report.records) == 3 and report.dropped == 2
+    assert [entry['stage'] for entry in report.records] == ['read', 'predict', 'read']
+    assert {stage: total['calls'] for stage, total in report.totals.items()} == {'read': 3, 'predict': 2}
+    assert report.totals['read']['rows_out'] == 30
+
+    report.write_json(str(tmp_path / 'run_report.json'))
+    written = json.loads((tmp_path / 'run_report.json').read_text())
+    assert len(written['records']) == 3 and written['dropped_records'] == 2
+    assert written['stages']['predict']['calls'] == 2
+
+    report.write_openmetrics(str(tmp_path / 'metrics.prom'))
+    assert 'pipeline_stage_calls_total{stage="read"} 3' in (tmp_path / 'metrics.prom').read_text()
+
+
+def test_clear_starts_a_new_report():
+    report = RunReport()
+    record(report, 'read')
+    report.clear()
+    assert len(report.records) == 0 and report.totals == {} and report.dropped == 0
+    record(report, 'combine')
+    assert list(report.to_frame()['stage']) == ['combine'] and isinstance(report.to_frame(), pd.DataFrame)
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pipeline.processors.processor import RfPredictionModel, ShardedRfPredictionModel
+from pipeline.writer.writer import PEST, RAIN, TEMP, YIELD
+
+pytest.importorskip('sklearn')
+
+FEATURES = [TEMP, RAIN, PEST]
+
+
+@pytest.fixture
+def rf_model(merged):
+    rf_model = RfPredictionModel(merged, FEATURES, YIELD, {'n_estimators': 10, 'n_jobs': 1})
+    rf_model.train_and_evaluate()
+    return rf_model
+
+
+def test_save_and_load_round_trip(rf_model, merged, tmp_path):
+    path = str(tmp_path / 'models' / 'rf.joblib')
+    rf_model.save(path)
+    loaded = RfPredictionModel.from_file(path)
+    assert (loaded.features_column, loaded.target_column) == (FEATURES, YIELD)
+    assert loaded.score == rf_model.score and loaded.mse == rf_model.mse
+    np.testing.assert_array_equal(loaded.feature_importance, rf_model.feature_importance)
+    pd.testing.assert_series_equal(loaded.predict_batch(merged), rf_model.predict_batch(merged))
+
+
+def test_train_or_load_reuses_the_saved_model(merged, tmp_path, monkeypatch):
+    params = {'n_estimators': 10, 'n_jobs': 1}
+    path = RfPredictionModel(merged, FEATURES, YIELD, params).train_or_load(str(tmp_path))
+
+    def train(self):
+        raise AssertionError("the saved model should be loaded")
+
+    monkeypatch.setattr(RfPredictionModel, 'train_and_evaluate', train)
+    again = RfPredictionModel(merged, FEATURES, YIELD, params)
+    assert again.train_or_load(str(tmp_path)) == path and again.model is not None
+    # other hyperparameters are another model
+    with pytest.raises(AssertionError):
+        RfPredictionModel(merged, FEATURES, YIELD, {**params, 'max_depth': 4}).train_or_load(str(tmp_path))
+
+
+def test_predict_batch_in_chunks(rf_model, merged, tmp_path):
+    expected = rf_model.model.predict(merged[FEATURES].to_numpy(dtype=np.float32))
+    result = rf_model.predict_batch(merged, chunksize=7)
+    assert result.name == YIELD
+    pd.testing.assert_index_equal(result.index, merged.index)
+    np.testing.assert_array_equal(result.to_numpy(), expected)
+
+    # a csv only needs the feature columns
+    path = tmp_path / 'features.csv'
+    merged[FEATURES].to_csv(path, index=False)
+    np.testing.assert_allclose(rf_model.predict_batch(str(path), chunksize=7).to_numpy(), expected, rtol=1e-5)
+
+
+def test_predict_batch_errors_and_empty_input(rf_model, merged):
+    with pytest.raises(ValueError, match='missing feature columns'):
+        rf_model.predict_batch(merged.drop(columns=[PEST]))
+    with pytest.raises(ValueError, match='not trained'):
+        RfPredictionModel(merged, FEATURES, YIELD).predict_batch(merged)
+    assert rf_model.predict_batch(merged.iloc[:0]).empty
+
+
+def test_sharded_model_keys_and_routing(merged):
+    sharded = ShardedRfPredictionModel(merged, FEATURES, YIELD, params={'n_estimators': 5})
+    sharded.train_and_evaluate(n_jobs=1)
+    assert set(sharded.models) == {'Maize', 'Wheat'}
+    maize = merged[merged['crop_types'] == 'Maize']
+    expected = sharded.models['Maize'].predict_batch(maize)
+
+    # unknown shards get NaN
+    data = pd.concat([maize, merged.head(1).assign(crop_types='Rice').set_axis([len(merged)])])
+    predictions = sharded.predict(data)
+    np.testing.assert_array_equal(predictions.loc[maize.index].to_numpy(), expected.to_numpy())
+    assert predictions.iloc[-1:].isna().all()
+    assert list(sharded.get_metrics().index) == ['Maize', 'Wheat', 'overall']
+
+
+def test_sharded_model_with_several_columns(merged):
+    data = merged.assign(Continent=np.where(merged['Country'] == 'Chad', 'Africa', 'Europe'))
+    with pytest.warns(UserWarning, match='not trained'):
+        sharded = ShardedRfPredictionModel(data, FEATURES, YIELD, ('crop_types', 'Continent'),
+                                           params={'n_estimators': 5}, min_rows=15)
+        sharded.train_and_evaluate(n_jobs=1)
+    # the Chad shards hold 10 rows each and are skipped
+    assert set(sharded.models) == {('Maize', 'Europe'), ('Wheat', 'Europe')}
+    assert sharded.predict(data)[data['Continent'] == 'Africa'].isna().all()
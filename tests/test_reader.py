@@ -0,0 +1,93 @@
+import os
+import pandas as pd
+import pytest
+from pipeline.reader.reader import read_cached, read_csv_file, read_rain_data, repair_rain_rows
+from pipeline.utils.constants import NA_VALUES, RAIN_SCHEMA
+
+RAIN = '''country,year,average_rain_fall_mm_per_year
+Albania,1990,1485
+Bolivia (Plurinational State of),1990,1146
+Congo, Democratic Republic of the,1990,1543
+"Korea, Republic of",1991,..
+Malformed row
+Zambia,1992,1020
+'''
+EXPECTED = pd.DataFrame({
+    'country': ['Albania', 'Bolivia (Plurinational State of)', 'Congo  Democratic Republic of the',
+                'Korea, Republic of', 'Zambia'],
+    'year': [1990, 1990, 1990, 1991, 1992],
+    'average_rain_fall_mm_per_year': [1485, 1146, 1543, None, 1020],
+})
+
+
+@pytest.fixture
+def rain_path(tmp_path):
+    path = tmp_path / 'rain.csv'
+    path.write_text(RAIN)
+    return str(path)
+
+
+def test_repair_rain_rows():
+    lines = ['Congo, Democratic Republic of the,1990,1543\n', '"Korea, Republic of",1991,12\n', 'short,row\n']
+    assert repair_rain_rows(lines) == [['Congo  Democratic Republic of the', '1990', '1543'],
+                                       ['Korea, Republic of', '1991', '12']]
+
+
+@pytest.mark.parametrize('engine', [None, 'c', 'pyarrow'])
+@pytest.mark.parametrize('chunksize', [2, 100])
+def test_read_rain_data_with_schema(rain_path, engine, chunksize):
+    if engine == 'pyarrow':
+        pytest.importorskip('pyarrow')
+    df = read_rain_data(rain_path, schema=RAIN_SCHEMA, na_values=NA_VALUES, engine=engine, chunksize=chunksize)
+    expected = EXPECTED.astype(RAIN_SCHEMA)
+    # the categories are the union of the chunk categories, in order of appearance
+    pd.testing.assert_frame_equal(df.astype({'country': str}), expected.astype({'country': str}))
+    assert df['country'].dtype == 'category'
+
+
+def test_read_rain_data_writes_the_repaired_file(rain_path, tmp_path):
+    new_path = str(tmp_path / 'modified_rain.csv')
+    df = read_rain_data(rain_path, new_path=new_path, na_values=NA_VALUES, chunksize=2)
+    pd.testing.assert_frame_equal(pd.read_csv(new_path, na_values=NA_VALUES), df)
+    pd.testing.assert_frame_equal(df, EXPECTED.astype({'average_rain_fall_mm_per_year': 'float64'}))
+
+
+@pytest.mark.parametrize('engine', [None, 'pyarrow'])
+def test_read_rain_data_header_only(tmp_path, engine):
+    if engine == 'pyarrow':
+        pytest.importorskip('pyarrow')
+    path = tmp_path / 'rain.csv'
+    path.write_text('country,year,average_rain_fall_mm_per_year\n')
+    df = read_rain_data(str(path), schema=RAIN_SCHEMA, engine=engine)
+    assert df.empty and list(df.columns) == list(RAIN_SCHEMA)
+
+
+def test_read_cached_invalidates_on_content_and_arguments(tmp_path):
+    pytest.importorskip('pyarrow')
+    path, cache_dir = tmp_path / 'yield.csv', str(tmp_path / 'cache')
+    path.write_text('Country;Year;Value\nAlbania;1990;1.5\n')
+    calls = []
+
+    def reader(csv_path, delimiter):
+        calls.append(csv_path)
+        return read_csv_file(csv_path, delimiter)
+
+    first = read_cached(reader, str(path), cache_dir, delimiter=';')
+    pd.testing.assert_frame_equal(read_cached(reader, str(path), cache_dir, delimiter=';'), first)
+    assert len(calls) == 1
+
+    # other reader arguments get their own entry
+    read_cached(reader, str(path), cache_dir, delimiter=',')
+    assert len(calls) == 2 and len(os.listdir(cache_dir)) == 2
+
+    # a changed file is read again and replaces the entry of its previous content
+    path.write_text('Country;Year;Value\nAlbania;1990;2.5\n')
+    changed = read_cached(reader, str(path), cache_dir, delimiter=';')
+    assert len(calls) == 3 and changed['Value'].tolist() == [2.5]
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_read_cached_without_cache_dir(tmp_path):
+    path = tmp_path / 'yield.csv'
+    path.write_text('Country;Year;Value\nAlbania;1990;1.5\n')
+    assert read_cached(read_csv_file, str(path), None, delimiter=';')['Value'].tolist() == [1.5]
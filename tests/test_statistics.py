@@ -0,0 +1,73 @@
+import pandas as pd
+from pipeline.writer.writer import REPORT_AGGREGATIONS, AggregationCache, PartitionStatistics, PEST, RAIN, TEMP, YIELD
+from tests.conftest import merged_frame
+
+COLUMNS = [YIELD, PEST, RAIN, TEMP]
+
+
+def test_plain_cache_keeps_no_partition_statistics(merged):
+    aggregates = AggregationCache(merged, REPORT_AGGREGATIONS)
+    pd.testing.assert_frame_equal(aggregates.describe(), merged.describe())
+    pd.testing.assert_frame_equal(aggregates.correlations(COLUMNS), merged.groupby('Country')[COLUMNS].mean().corr())
+    assert aggregates.statistics is None
+
+
+def test_partitioned_cache_matches_the_plain_one(merged):
+    plain, partitioned = AggregationCache(merged), AggregationCache(merged, partitioned=True)
+    pd.testing.assert_frame_equal(partitioned.describe(), plain.describe())
+    pd.testing.assert_frame_equal(partitioned.correlations(COLUMNS), plain.correlations(COLUMNS))
+    assert partitioned.statistics_version == partitioned.dataset_version()
+
+
+def test_statistics_describe_is_exact_for_small_data(merged):
+    statistics = PartitionStatistics()
+    statistics.compute(merged)
+    pd.testing.assert_frame_equal(statistics.describe(), merged.describe())
+
+
+def test_statistics_describe_approximates_large_data():
+    data = merged_frame([f"Country {i}" for i in range(40)], range(1960, 2010), seed=3)
+    statistics = PartitionStatistics(compression=100)
+    statistics.compute(data)
+    assert all(len(means) <= 100 for means, weights in statistics.digests.values())
+
+    result, expected = statistics.describe(), data.describe()
+    moments = ['count', 'mean', 'std', 'min', 'max']
+    pd.testing.assert_frame_equal(result.loc[moments], expected.loc[moments])
+    # the quartiles come from the digest, within a fraction of the value range
+    error = (result - expected).loc[['25%', '50%', '75%']].abs() / (expected.loc['max'] - expected.loc['min'])
+    assert (error < 0.01).all().all()
+
+
+def test_statistics_update_merges_new_partitions(merged):
+    statistics = PartitionStatistics()
+    statistics.compute(merged[merged['Year'] < 2009])
+    statistics.update(merged, merged[merged['Year'] == 2009], merged.iloc[:0])
+    pd.testing.assert_frame_equal(statistics.describe(), merged.describe())
+
+
+def test_statistics_update_with_removed_rows_recomputes(merged):
+    statistics = PartitionStatistics()
+    statistics.compute(merged)
+    revised = (merged['Country'] == 'Chad') & (merged['Year'] == 2005)
+    data = merged.assign(**{YIELD: merged[YIELD].mask(revised, 1.0)})
+    statistics.update(data, data[revised], merged[revised])
+    pd.testing.assert_frame_equal(statistics.describe(), data.describe())
+
+
+def test_statistics_correlations(merged):
+    statistics = PartitionStatistics()
+    statistics.compute(merged)
+    expected = merged.groupby('Country')[COLUMNS].mean().corr()
+    pd.testing.assert_frame_equal(statistics.correlations(COLUMNS), expected)
+
+
+def test_statistics_save_and_restore(merged, tmp_path):
+    statistics = PartitionStatistics()
+    assert not statistics.restore(str(tmp_path))
+    statistics.compute(merged)
+    statistics.save(str(tmp_path))
+
+    restored = PartitionStatistics()
+    assert restored.restore(str(tmp_path))
+    pd.testing.assert_frame_equal(restored.describe(), statistics.describe())